@@ -9,11 +9,11 @@ from telegram.error import TelegramError
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
     ConversationHandler, MessageHandler, filters,
-    PreCheckoutQueryHandler, ContextTypes, PicklePersistence
+    PreCheckoutQueryHandler, ContextTypes, PicklePersistence, TypeHandler
 )
 
 from src.config import (
-    BOT_TOKEN, SELECTING_LANG, SELECTING_ACTION, SELECTING_CONTENT_TYPE,
+    BOT_TOKEN, TELEGRAM_BOT_API_URL, MAX_CONCURRENT_UPDATES, SELECTING_LANG, SELECTING_ACTION, SELECTING_CONTENT_TYPE,
     RECEIVING_CONTENT, SELECTING_TIME, SELECTING_DATE, PROCESSING_RECIPIENT,
     CONFIRMING_CAPSULE, VIEWING_CAPSULES, MANAGING_SUBSCRIPTION, MANAGING_SETTINGS,
     SELECTING_PAYMENT_METHOD, SELECTING_CURRENCY, MANAGING_LEGAL_INFO,
@@ -23,6 +23,7 @@ from src.config import (
 
 from src.database import init_db, get_user_data
 from src.scheduler import init_scheduler
+from src.update_processor import PerChatUpdateProcessor
 from src.translations import t  # ADD MISSING IMPORT
 
 # ============================================================================
@@ -44,7 +45,9 @@ from src.handlers.create_capsule import (
     process_recipient,
     process_self_recipient,
     confirm_capsule,
+    drop_repeated_press,
 )
+from src.handlers.user_context import populate_user_context
 
 # Ideas Handlers (NEW)
 from src.handlers.ideas import show_ideas_menu, ideas_router, ideas_text_input, ideas_date_input  # NEW - also added ideas_date_input
@@ -164,12 +167,36 @@ async def main():
 
     # Create application with persistence
     persistence = PicklePersistence(filepath="conversation_data.pickle")
-    application = Application.builder().token(BOT_TOKEN).persistence(persistence).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .persistence(persistence)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if TELEGRAM_BOT_API_URL:
+        # Local Bot API server: get_file returns paths on the shared disk
+        builder = (
+            builder.base_url(f"{TELEGRAM_BOT_API_URL}/bot")
+            .base_file_url(f"{TELEGRAM_BOT_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    application = builder.build()
 
     # Initialize and store scheduler
     scheduler = init_scheduler(application)
     application.bot_data['scheduler'] = scheduler
 
+    # Runs ahead of every other handler: caches the user row and stores
+    # the user's language for the handlers that follow
+    application.add_handler(TypeHandler(Update, populate_user_context), group=-1)
+
+    # Runs before the user row is even loaded: drops repeated presses of the
+    # capsule creation buttons
+    application.add_handler(
+        CallbackQueryHandler(drop_repeated_press, pattern='^(type_|time_|recipient_self$)'),
+        group=-2
+    )
+
     # ========================================================================
     # CONVERSATION HANDLER - Main bot logic
     # ========================================================================
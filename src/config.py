@@ -34,11 +34,18 @@ DEFAULT_IMAGE = os.path.join(ASSETS_DIR, MENU_IMAGES['welcome'])
 # Environment variables
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///time_capsule.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '40'))
 MASTER_KEY = os.getenv('MASTER_KEY')
 YANDEX_ACCESS_KEY = os.getenv('YANDEX_ACCESS_KEY')
 YANDEX_SECRET_KEY = os.getenv('YANDEX_SECRET_KEY')
 YANDEX_BUCKET_NAME = os.getenv('YANDEX_BUCKET_NAME')
 YANDEX_REGION = os.getenv('YANDEX_REGION', 'ru-central1')
+S3_MAX_CONCURRENT = int(os.getenv('S3_MAX_CONCURRENT', '32'))  # Parallel S3 requests
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', '4'))  # Parallel parts per upload
+TELEGRAM_MAX_CONCURRENT_DOWNLOADS = int(os.getenv('TELEGRAM_MAX_CONCURRENT_DOWNLOADS', '16'))
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))  # Updates of different chats in flight
+TELEGRAM_BOT_API_URL = os.getenv('TELEGRAM_BOT_API_URL')  # Local Bot API server, e.g. http://localhost:8081
 PAYMENT_PROVIDER_TOKEN = os.getenv('PAYMENT_PROVIDER_TOKEN')  # For Redsys/Stripe
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
 
@@ -1,15 +1,43 @@
 # src/database.py
+import asyncio
+import base64
+import functools
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, Dict
 from sqlalchemy import (
     create_engine, MetaData, Table, Column, Integer, String,
     DateTime, ForeignKey, Boolean, BigInteger, Text, select,
-    insert, update as sqlalchemy_update, LargeBinary, Float
+    insert, update as sqlalchemy_update, LargeBinary, Float, Index
 )
 from telegram import User
-from .config import DATABASE_URL, logger, PREMIUM_TIER, PREMIUM_CAPSULE_LIMIT, FREE_CAPSULE_LIMIT, PREMIUM_STORAGE_LIMIT, FREE_STORAGE_LIMIT
+from .config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, logger, PREMIUM_TIER,
+    PREMIUM_CAPSULE_LIMIT, FREE_CAPSULE_LIMIT, PREMIUM_STORAGE_LIMIT, FREE_STORAGE_LIMIT
+)
+
+# Keep a warm connection pool so concurrent handlers reuse connections
+# instead of paying connect/TLS setup on every request
+_pool_options = {'pool_pre_ping': True}
+if not DATABASE_URL.startswith('sqlite'):
+    _pool_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+engine = create_engine(DATABASE_URL, echo=False, **_pool_options)
+
+# Blocking queries issued from handlers run here rather than in asyncio's
+# default executor, which S3 transfers also use. One thread per pooled
+# connection, so a worker never waits for a free connection
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE + DB_MAX_OVERFLOW, thread_name_prefix='db')
+
+
+async def run_db(func, *args):
+    """Run a blocking database function without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
 
-engine = create_engine(DATABASE_URL, echo=False)
 metadata = MetaData()
 
 # Users table
@@ -29,11 +57,33 @@ users = Table('users', metadata,
 )
 
 
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7): 48-bit ms timestamp + random bits"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | (0x7 << 76)  # version
+    value = value & ~(0x3 << 62) | (0x2 << 62)  # RFC variant
+    return uuid.UUID(int=value)
+
+
+def capsule_invite_token(capsule_uuid: str) -> str:
+    """Deep-link token for a capsule: its 16 UUID bytes as unpadded URL-safe base64 (22 chars)"""
+    return base64.urlsafe_b64encode(uuid.UUID(capsule_uuid).bytes).decode().rstrip('=')
+
+
+def capsule_uuid_from_token(token: str) -> str:
+    """Capsule UUID from an invite token.
+    Links created before the compact format carry the base64 of the UUID string"""
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    if len(raw) == 16:
+        return str(uuid.UUID(bytes=raw))
+    return raw.decode()
+
 # Capsules table
 capsules = Table('capsules', metadata,
     Column('id', Integer, primary_key=True),
     Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
-    Column('capsule_uuid', String(36), unique=True, nullable=False, index=True),
+    Column('capsule_uuid', String(36), unique=True, nullable=False, index=True,
+           default=lambda: str(uuid7())),
     Column('content_type', String(50), nullable=False),
     Column('content_text', Text, nullable=True),
     Column('file_key', LargeBinary, nullable=True),
@@ -47,7 +97,10 @@ capsules = Table('capsules', metadata,
     Column('delivered', Boolean, default=False),
     Column('delivered_at', DateTime, nullable=True),
     Column('activated_at', DateTime, nullable=True),
-    Column('message', Text, nullable=True)
+    Column('message', Text, nullable=True),
+    # Serves the "My capsules" list (see migration 008)
+    Index('ix_capsules_user_pending', 'user_id', 'delivered', 'delivery_time',
+          postgresql_include=['content_type', 'recipient_type', 'created_at'])
 )
 
 # Payments table
@@ -174,17 +227,21 @@ def check_user_quota(user_data: Dict, file_size: int = 0) -> tuple[bool, str]:
     return True, ""
 
 
-def delete_capsule(capsule_id: int):
-    """Delete a capsule from the database"""
+def delete_capsule(capsule_id: int) -> Optional[str]:
+    """Delete a capsule from the database. Returns its S3 key if it had a file"""
     try:
-        with engine.connect() as conn:
-            conn.execute(
-                capsules.delete().where(capsules.c.id == capsule_id)
-            )
-            conn.commit()
-            logger.info(f"Capsule {capsule_id} deleted from database")
+        with engine.begin() as conn:
+            # One round-trip: the deleted row hands back its S3 key
+            s3_key = conn.execute(
+                capsules.delete()
+                .where(capsules.c.id == capsule_id)
+                .returning(capsules.c.s3_key)
+            ).scalar()
+        logger.info(f"Capsule {capsule_id} deleted from database")
+        return s3_key
     except Exception as e:
         logger.error(f"Error deleting capsule {capsule_id} from database: {e}")
+        return None
 
 def get_user_stats(telegram_id: int) -> Optional[Dict]:
     """Get comprehensive user statistics"""
@@ -328,6 +385,40 @@ def mark_capsule_delivered(capsule_id: int) -> bool:
         logger.error(f"Error marking capsule as delivered: {e}")
         return False
 
+def claim_capsule_for_delivery(capsule_id: int) -> bool:
+    """Mark a capsule as delivered if nobody has yet.
+    Returns True only for the one caller that flipped it, so a capsule
+    picked up by two delivery runs is sent once"""
+    try:
+        with engine.begin() as conn:
+            claimed = conn.execute(
+                sqlalchemy_update(capsules)
+                .where(capsules.c.id == capsule_id, capsules.c.delivered == False)
+                .values(
+                    delivered=True,
+                    delivered_at=datetime.utcnow()
+                )
+                .returning(capsules.c.id)
+            ).first()
+            return claimed is not None
+    except Exception as e:
+        logger.error(f"Error claiming capsule for delivery: {e}")
+        return False
+
+def release_capsule_claim(capsule_id: int) -> bool:
+    """Undo claim_capsule_for_delivery so the next check retries the capsule"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                sqlalchemy_update(capsules)
+                .where(capsules.c.id == capsule_id)
+                .values(delivered=False, delivered_at=None)
+            )
+            return True
+    except Exception as e:
+        logger.error(f"Error releasing capsule claim: {e}")
+        return False
+
 def delete_capsule_and_update_user(capsule_id: int, user_id: int) -> tuple[bool, int]:
     """Delete a capsule and update user's storage/count. Returns (success, file_size)"""
     try:
@@ -376,11 +467,13 @@ def create_capsule(user_id: int, capsule_data: Dict) -> Optional[int]:
     NOW SUPPORTS: recipient_username for @username delivery
     """
     try:
-        with engine.connect() as conn:
-            result = conn.execute(
+        # One transaction: the capsule and the user stats commit or roll back together
+        with engine.begin() as conn:
+            values = {'capsule_uuid': capsule_data['capsule_uuid']} if capsule_data.get('capsule_uuid') else {}
+            capsule_id = conn.execute(
                 insert(capsules).values(
                     user_id=user_id,
-                    capsule_uuid=capsule_data['capsule_uuid'],
+                    **values,
                     content_type=capsule_data['content_type'],
                     content_text=capsule_data.get('content_text'),
                     file_key=capsule_data.get('file_key'),
@@ -391,10 +484,8 @@ def create_capsule(user_id: int, capsule_data: Dict) -> Optional[int]:
                     recipient_username=capsule_data.get('recipient_username'),  # NEW!
                     delivery_time=capsule_data['delivery_time'],
                     message=capsule_data.get('message')
-                )
-            )
-            conn.commit()
-            capsule_id = result.inserted_primary_key[0]
+                ).returning(capsules.c.id)
+            ).scalar_one()
 
             # Update user statistics
             file_size = capsule_data.get('file_size', 0)
@@ -406,9 +497,8 @@ def create_capsule(user_id: int, capsule_data: Dict) -> Optional[int]:
                     total_storage_used=users.c.total_storage_used + file_size
                 )
             )
-            conn.commit()
 
-            return capsule_id
+        return capsule_id
     except Exception as e:
         logger.error(f"Error creating capsule: {e}")
         return None
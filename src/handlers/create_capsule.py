@@ -1,22 +1,261 @@
-import base64
-import uuid
+import asyncio
+import calendar
+import os
+import re
+import time
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional
+import httpx
 from datetime import datetime, timedelta, timezone
-from dateutil.relativedelta import relativedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext import ApplicationHandlerStop, ContextTypes, ConversationHandler
 from telegram.error import BadRequest
-from sqlalchemy import select, insert, update as sqlalchemy_update
+from sqlalchemy import insert, bindparam, update as sqlalchemy_update
+from sqlalchemy.exc import SQLAlchemyError
 from ..image_menu import send_menu_with_image
 from ..config import (
     SELECTING_ACTION, SELECTING_CONTENT_TYPE, RECEIVING_CONTENT,
     SELECTING_TIME, SELECTING_DATE, SELECTING_RECIPIENT, PROCESSING_RECIPIENT,
     CONFIRMING_CAPSULE, PREMIUM_TIME_LIMIT_DAYS, FREE_TIME_LIMIT_DAYS,
     PREMIUM_TIER, FREE_TIER, PREMIUM_STORAGE_LIMIT, FREE_STORAGE_LIMIT,
-    logger
+    TELEGRAM_MAX_CONCURRENT_DOWNLOADS, logger
 )
-from ..database import get_user_data, check_user_quota, users, capsules, engine
-from ..s3_utils import encrypt_and_upload_file
-from ..translations import t
+from ..database import (
+    check_user_quota, capsule_invite_token, users, capsules, engine, run_db
+)
+from ..s3_utils import encrypt_and_upload_stream, schedule_s3_delete
+from ..translations import TRANSLATIONS, t, t_many
+from ..timezone_utils import convert_local_to_utc, format_time_for_user
+from .user_context import current_lang, invalidate_user_cache, load_user_data
+
+# Offsets for the quick delivery time buttons (callback_data 'time_<key>').
+# Whole months are stored as an int and applied with add_months
+TIME_DELTAS = {
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+    '1w': timedelta(weeks=1),
+    '1m': 1,
+    '3m': 3,
+    '6m': 6,
+    '1y': 12,
+    '5y': 12 * 5,
+    '10y': 12 * 10,
+    '25y': 12 * 25,
+}
+
+
+def add_months(dt: datetime, months: int) -> datetime:
+    """Shift dt by whole months, clamping the day to the length of the target month"""
+    month_index = dt.month - 1 + months
+    year = dt.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(dt.day, calendar.monthrange(year, month)[1])
+    return dt.replace(year=year, month=month, day=day)
+
+CONTENT_TYPES = ('text', 'photo', 'video', 'document', 'voice')
+
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # 50MB limit
+
+# Repeats of the same creation button in a chat within this window are dropped
+DEBOUNCE_SECONDS = 0.5
+
+# Bounds parallel media downloads from Telegram during bursts
+_download_slots = asyncio.Semaphore(TELEGRAM_MAX_CONCURRENT_DOWNLOADS)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Shared HTTP client for streaming files from Telegram"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=120.0))
+    return _http_client
+
+
+class _TelegramFileStream:
+    """Async iterator over a Telegram file's bytes, stopped once max_bytes is exceeded.
+    file_path is a download URL, or a local path when a local Bot API server is used"""
+
+    def __init__(self, file_path: str, max_bytes: int):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    @property
+    def exceeded(self) -> bool:
+        return self.size > self.max_bytes
+
+    async def _chunks(self):
+        if os.path.isabs(self.file_path):
+            # Local Bot API server: the file is already on this machine's disk
+            with open(self.file_path, 'rb') as file:
+                while chunk := await asyncio.to_thread(file.read, DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+        else:
+            async with _get_http_client().stream('GET', self.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._chunks():
+            self.size += len(chunk)
+            if self.exceeded:
+                raise ValueError(f"file exceeds {self.max_bytes} bytes")
+            yield chunk
+
+def _utf8_size(text: str) -> int:
+    """Size of text in UTF-8 bytes; ASCII text is measured without encoding a copy"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8'))
+
+# Custom delivery date in the user's local time: DD.MM.YYYY HH:MM
+_DATE_RE = re.compile(r'^(\d{2})\.(\d{2})\.(\d{4})\s+(\d{2}):(\d{2})$')
+
+
+# Quick delivery time buttons as (translation key, callback_data), two per row
+_TIME_BUTTONS = (
+    ('time_1hour', 'time_1h'), ('time_1day', 'time_1d'),
+    ('time_1week', 'time_1w'), ('time_1month', 'time_1m'),
+    ('time_3months', 'time_3m'), ('time_6months', 'time_6m'),
+    ('time_1year', 'time_1y'),
+)
+_TIME_KEYS = tuple(key for key, _ in _TIME_BUTTONS) + ('time_custom', 'cancel')
+_CONTENT_TYPE_KEYS = tuple(f'content_{content_type}' for content_type in CONTENT_TYPES)
+
+
+@lru_cache(maxsize=None)
+def _content_type_names(lang: str) -> dict:
+    """Translated display names of the supported content types"""
+    return dict(zip(CONTENT_TYPES, t_many(lang, _CONTENT_TYPE_KEYS)))
+
+
+# ============================================================================
+# KEYBOARDS - pure functions of the language, built once and reused
+# ============================================================================
+
+@lru_cache(maxsize=None)
+def _content_type_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Content type selection keyboard"""
+    names = _content_type_names(lang)
+    keyboard = [[InlineKeyboardButton(names[content_type], callback_data=f'type_{content_type}')]
+                for content_type in CONTENT_TYPES]
+    keyboard.append([InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@lru_cache(maxsize=None)
+def _time_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Delivery time selection keyboard"""
+    *labels, custom_label, cancel_label = t_many(lang, _TIME_KEYS)
+    buttons = [InlineKeyboardButton(label, callback_data=callback_data)
+               for label, (_, callback_data) in zip(labels, _TIME_BUTTONS)]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([InlineKeyboardButton(custom_label, callback_data='time_custom')])
+    keyboard.append([InlineKeyboardButton(cancel_label, callback_data='cancel')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@lru_cache(maxsize=None)
+def _recipient_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Recipient prompt keyboard"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(t(lang, 'recipient_self'), callback_data='recipient_self')],
+        [InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]
+    ])
+
+
+@lru_cache(maxsize=None)
+def _confirm_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Capsule confirmation keyboard"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(t(lang, 'confirm_yes'), callback_data='confirm_yes')],
+        [InlineKeyboardButton(t(lang, 'confirm_no'), callback_data='cancel')]
+    ])
+
+
+@lru_cache(maxsize=None)
+def _buy_capsules_keyboard(lang: str, back_key: str = 'back') -> InlineKeyboardMarkup:
+    """Keyboard shown when the capsule balance is empty"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(t(lang, 'buy_capsules'), callback_data='subscription')],
+        [InlineKeyboardButton(t(lang, back_key), callback_data='main_menu')]
+    ])
+
+
+@lru_cache(maxsize=None)
+def _upgrade_keyboard(lang: str, upgrade_key: str) -> InlineKeyboardMarkup:
+    """Keyboard shown when the delivery date exceeds the plan limit"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(t(lang, upgrade_key), callback_data='subscription')],
+        [InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')]
+    ])
+
+
+@lru_cache(maxsize=None)
+def _single_button_keyboard(lang: str, text_key: str, callback_data: str) -> InlineKeyboardMarkup:
+    """One-button keyboard (back / cancel / main menu)"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(t(lang, text_key), callback_data=callback_data)]])
+
+
+def _storage_limit(user_data: dict) -> int:
+    """Storage quota in bytes for the user's plan"""
+    return FREE_STORAGE_LIMIT if user_data['subscription_status'] == FREE_TIER else PREMIUM_STORAGE_LIMIT
+
+
+def _storage_limit_text(lang: str, user_data: dict) -> str:
+    """Storage limit message with the user's usage and plan quota"""
+    return t(lang, 'storage_limit_reached',
+             used_mb=user_data['total_storage_used'] / (1024*1024),
+             limit_mb=_storage_limit(user_data) / (1024*1024))
+
+
+# Build the fixed flow keyboards for every supported language at import, so
+# no user pays for the first build; other variants fill the caches on demand
+for _lang in TRANSLATIONS:
+    _content_type_keyboard(_lang)
+    _time_keyboard(_lang)
+    _recipient_keyboard(_lang)
+    _confirm_keyboard(_lang)
+    _single_button_keyboard(_lang, 'cancel', 'cancel')
+    _single_button_keyboard(_lang, 'main_menu', 'main_menu')
+
+
+@dataclass(slots=True)
+class CapsuleDraft:
+    """Capsule being assembled by the creation flow, kept in context.user_data['capsule']"""
+    content_type: Optional[str] = None
+    content_text: Optional[str] = None
+    s3_key: Optional[str] = None
+    file_key: Optional[bytes] = None
+    file_size: int = 0
+    delivery_time: Optional[datetime] = None
+    recipient_type: Optional[str] = None
+    recipient_id: Optional[int] = None
+    recipient_username: Optional[str] = None
+    recipient_name: Optional[str] = None
+    # Set when the flow was started from an idea template
+    prefill_delivery_time: Optional[datetime] = None
+    prefill_recipient: Optional[str] = None
+
+
+_DRAFT_FIELDS = frozenset(field.name for field in fields(CapsuleDraft))
+
+
+def _draft(context: ContextTypes.DEFAULT_TYPE) -> CapsuleDraft:
+    """The capsule draft of this conversation.
+    Drafts persisted as plain dicts by earlier versions are converted in place"""
+    capsule = context.user_data.get('capsule')
+    if not isinstance(capsule, CapsuleDraft):
+        capsule = CapsuleDraft(**{key: value for key, value in (capsule or {}).items() if key in _DRAFT_FIELDS})
+        context.user_data['capsule'] = capsule
+    return capsule
+
 
 async def start_create_capsule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start capsule creation flow"""
@@ -25,32 +264,30 @@ async def start_create_capsule(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.answer()
 
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    # Refresh at flow start so balance and storage checks see current values
+    user_data = await load_user_data(update, context, refresh=True)
     if not user_data:
         logger.error(f"No user data found for user {user.id}")
         return SELECTING_ACTION
 
     lang = user_data['language_code']
+    current_lang.set(lang)
 
     # Check capsule balance
     if user_data.get('capsule_balance', 0) <= 0:
-        keyboard = [[InlineKeyboardButton(t(lang, 'buy_capsules'), callback_data='subscription')],
-                    [InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')]]
-        await send_menu_with_image(update, context, 'capsules', t(lang, 'no_capsule_balance'), InlineKeyboardMarkup(keyboard))
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'no_capsule_balance'), _buy_capsules_keyboard(lang))
         return SELECTING_ACTION
 
     # Check storage quota
     can_create, error_msg = check_user_quota(user_data, 0)
     if not can_create and error_msg == "storage_limit_reached":
-        storage_limit = FREE_STORAGE_LIMIT if user_data['subscription_status'] == FREE_TIER else PREMIUM_STORAGE_LIMIT
-        keyboard = [[InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')]]
         await send_menu_with_image(update, context, 'capsules',
-                                  t(lang, 'storage_limit_reached', limit=f"{storage_limit // (1024*1024)} MB"),
-                                  InlineKeyboardMarkup(keyboard))
+                                  _storage_limit_text(lang, user_data),
+                                  _single_button_keyboard(lang, 'back', 'main_menu'))
         return SELECTING_ACTION
 
     # Initialize capsule data structure
-    context.user_data['capsule'] = {}
+    capsule = context.user_data['capsule'] = CapsuleDraft()
     
     # Check for prefill data from ideas module
     prefill_text = context.user_data.get('prefill_text')
@@ -60,19 +297,18 @@ async def start_create_capsule(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # If prefill data exists from ideas, set it in the capsule
     if prefill_text:
-        context.user_data['capsule']['content_text'] = prefill_text
-        context.user_data['capsule']['content_type'] = prefill_content_type
-        context.user_data['capsule']['file_size'] = len(prefill_text.encode('utf-8'))
+        capsule.content_text = prefill_text
+        capsule.content_type = prefill_content_type
+        capsule.file_size = _utf8_size(prefill_text)
         logger.info(f"Prefill content loaded from ideas for user {user.id}")
         
         # If delivery time was pre-filled, store it for later use
         if prefill_delivery_iso:
-            from datetime import datetime
-            context.user_data['capsule']['prefill_delivery_time'] = datetime.fromisoformat(prefill_delivery_iso)
+            capsule.prefill_delivery_time = datetime.fromisoformat(prefill_delivery_iso)
         
         # If recipient was pre-filled, store it for later use
         if prefill_recipient:
-            context.user_data['capsule']['prefill_recipient'] = prefill_recipient
+            capsule.prefill_recipient = prefill_recipient
 
     logger.info(f"Starting capsule creation for user {user.id}")
 
@@ -82,52 +318,64 @@ async def start_create_capsule(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"Using prefill data, skipping content selection for user {user.id}")
         return await show_time_selection(update, context)
 
-    keyboard = [
-        [InlineKeyboardButton(t(lang, 'content_text'), callback_data='type_text')],
-        [InlineKeyboardButton(t(lang, 'content_photo'), callback_data='type_photo')],
-        [InlineKeyboardButton(t(lang, 'content_video'), callback_data='type_video')],
-        [InlineKeyboardButton(t(lang, 'content_document'), callback_data='type_document')],
-        [InlineKeyboardButton(t(lang, 'content_voice'), callback_data='type_voice')],
-        [InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]
-    ]
-    await send_menu_with_image(update, context, 'capsules', t(lang, 'select_content_type'), InlineKeyboardMarkup(keyboard))
+    await send_menu_with_image(update, context, 'capsules', t(lang, 'select_content_type'), _content_type_keyboard(lang))
     return SELECTING_CONTENT_TYPE
 
 
+async def drop_repeated_press(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Registered ahead of the conversation: answers and stops a press of the
+    same button in the same chat within DEBOUNCE_SECONDS, so mashing a button
+    costs no DB lookup and no menu redraw"""
+    query = update.callback_query
+    now = time.monotonic()
+    presses = context.chat_data.setdefault('_last_press', {})
+    last = presses.get(query.data)
+    presses.clear()
+    presses[query.data] = now
+    # The monotonic clock restarts with the process, while chat_data persists
+    if last is not None and 0 <= now - last < DEBOUNCE_SECONDS:
+        await query.answer()
+        raise ApplicationHandlerStop
+
+
 async def select_content_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle content type selection"""
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    user_data = get_user_data(user.id)
-    lang = user_data['language_code']
+    lang = current_lang.get()
 
     content_type = query.data.replace('type_', '')
-    context.user_data['capsule']['content_type'] = content_type
+    _draft(context).content_type = content_type
     logger.info(f"User {user.id} selected content type: {content_type}")
 
-    type_names = {
-        'text': t(lang, 'content_text'),
-        'photo': t(lang, 'content_photo'),
-        'video': t(lang, 'content_video'),
-        'document': t(lang, 'content_document'),
-        'voice': t(lang, 'content_voice')
-    }
-    instruction_text = t(lang, 'send_content', type=type_names.get(content_type, content_type))
-
-    keyboard = [[InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]]
-    await send_menu_with_image(update, context, 'capsules', instruction_text, InlineKeyboardMarkup(keyboard))
+    instruction_text = t(lang, 'send_content', type=_content_type_names(lang).get(content_type, content_type))
+
+    await send_menu_with_image(update, context, 'capsules', instruction_text, _single_button_keyboard(lang, 'cancel', 'cancel'))
     return RECEIVING_CONTENT
 
 
+async def _reply_quota_error(message, lang: str, user_data: dict, error_msg: str) -> int:
+    """Tell the user why the upload was rejected by check_user_quota and offer an upgrade"""
+    if error_msg == "storage_limit_reached":
+        await message.reply_text(_storage_limit_text(lang, user_data),
+                                 reply_markup=_upgrade_keyboard(lang, 'upgrade_subscription'))
+    elif error_msg == "no_capsule_balance":
+        await message.reply_text(t(lang, 'insufficient_balance'), reply_markup=_buy_capsules_keyboard(lang))
+    else:
+        await message.reply_text(t(lang, 'error_occurred'))
+        return ConversationHandler.END
+    return SELECTING_ACTION
+
+
 async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive capsule content"""
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
     lang = user_data['language_code']
     message = update.message
-    capsule = context.user_data.get('capsule', {})
-    content_type = capsule.get('content_type')
+    capsule = _draft(context)
+    content_type = capsule.content_type
 
     if not content_type:
         await message.reply_text(t(lang, 'error_occurred'))
@@ -137,53 +385,64 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     if content_type == 'text':
         if not message.text:
-            await message.reply_text(t(lang, 'send_content', type=t(lang, 'content_text')))
+            await message.reply_text(t(lang, 'send_content', type=_content_type_names(lang)['text']))
             return RECEIVING_CONTENT
-        context.user_data['capsule']['content_text'] = message.text
-        context.user_data['capsule']['file_size'] = len(message.text.encode('utf-8'))
+        capsule.content_text = message.text
+        capsule.file_size = _utf8_size(message.text)
     else:
-        file = None
+        attachment = None
         ext = 'bin'
 
         if content_type == 'photo' and message.photo:
-            file = await message.photo[-1].get_file()
+            attachment = message.photo[-1]
             ext = 'jpg'
         elif content_type == 'video' and message.video:
-            file = await message.video.get_file()
+            attachment = message.video
             ext = 'mp4'
         elif content_type == 'document' and message.document:
-            file = await message.document.get_file()
+            attachment = message.document
             ext = message.document.file_name.split('.')[-1] if message.document.file_name and '.' in message.document.file_name else 'bin'
         elif content_type == 'voice' and message.voice:
-            file = await message.voice.get_file()
+            attachment = message.voice
             ext = 'ogg'
 
-        if not file:
-            await message.reply_text(t(lang, 'send_content', type=t(lang, f'content_{content_type}')))
+        if not attachment:
+            await message.reply_text(t(lang, 'send_content', type=_content_type_names(lang).get(content_type, content_type)))
             return RECEIVING_CONTENT
 
-        # Check file size before uploading
-        if file.file_size and file.file_size > 50 * 1024 * 1024:  # 50MB limit
+        # Check size and quota from the message itself, before any file request
+        # or download. Telegram may omit file_size; then the size is checked
+        # again once the bytes are in.
+        if attachment.file_size and attachment.file_size > MAX_UPLOAD_SIZE:
             await message.reply_text(t(lang, 'file_too_large'))
             return RECEIVING_CONTENT
 
-        # Check storage quota
-        user_data_fresh = get_user_data(user.id)
-        can_create, error_msg = check_user_quota(user_data_fresh, file.file_size or 0)
+        can_create, error_msg = check_user_quota(user_data, attachment.file_size or 0)
         if not can_create:
-            if error_msg == "storage_limit_reached":
-                storage_limit = FREE_STORAGE_LIMIT if user_data_fresh['subscription_status'] == FREE_TIER else PREMIUM_STORAGE_LIMIT
-                await message.reply_text(t(lang, 'storage_limit_reached', limit=f"{storage_limit // (1024*1024)} MB"))
-            else:
-                await message.reply_text(t(lang, 'error_occurred'))
-            return ConversationHandler.END
+            return await _reply_quota_error(message, lang, user_data, error_msg)
+
+        # Stream the file from Telegram straight into an encrypted multipart
+        # upload; the stream stops as soon as it exceeds the size limit or the
+        # remaining storage, which covers files without an advertised size
+        max_bytes = min(MAX_UPLOAD_SIZE, _storage_limit(user_data) - user_data['total_storage_used'])
 
         try:
-            file_bytes = await file.download_as_bytearray()
-            s3_key, encrypted_key = encrypt_and_upload_file(bytes(file_bytes), ext)
-            context.user_data['capsule']['s3_key'] = s3_key
-            context.user_data['capsule']['file_key'] = encrypted_key
-            context.user_data['capsule']['file_size'] = file.file_size or 0
+            async with _download_slots:
+                file = await attachment.get_file()
+                stream = _TelegramFileStream(file.file_path, max_bytes)
+                s3_key, encrypted_key = await encrypt_and_upload_stream(stream, ext)
+
+            if stream.exceeded:
+                if stream.size > MAX_UPLOAD_SIZE:
+                    await message.reply_text(t(lang, 'file_too_large'))
+                    return RECEIVING_CONTENT
+                return await _reply_quota_error(message, lang, user_data, "storage_limit_reached")
+
+            if not s3_key:
+                raise RuntimeError("upload to storage failed")
+            capsule.s3_key = s3_key
+            capsule.file_key = encrypted_key
+            capsule.file_size = stream.size
         except Exception as e:
             logger.error(f"Error uploading file for user {user.id}: {e}")
             await message.reply_text(t(lang, 'error_occurred'))
@@ -196,16 +455,15 @@ async def receive_content(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def show_time_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show time selection menu"""
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
     lang = user_data['language_code']
     
     # Check if prefill delivery time is available (from ideas module)
-    prefill_delivery_time = context.user_data.get('capsule', {}).get('prefill_delivery_time')
+    capsule = _draft(context)
+    prefill_delivery_time = capsule.prefill_delivery_time
     
     if prefill_delivery_time:
         # FIXED: Ensure timezone awareness
-        from datetime import timezone
-        
         # Convert to UTC if not already timezone-aware
         if prefill_delivery_time.tzinfo is None:
             prefill_delivery_time = prefill_delivery_time.replace(tzinfo=timezone.utc)
@@ -215,39 +473,20 @@ async def show_time_selection(update: Update, context: ContextTypes.DEFAULT_TYPE
         max_days = PREMIUM_TIME_LIMIT_DAYS if user_data['subscription_status'] == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
         
         if (prefill_delivery_time - now).days > max_days:
-            keyboard = [
-                [InlineKeyboardButton(t(lang, 'upgrade_subscription'), callback_data='subscription')],
-                [InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')]
-            ]
             await send_menu_with_image(
-                update, context, 'capsules', 
-                t(lang, 'date_too_far', days=FREE_TIME_LIMIT_DAYS, years=PREMIUM_TIME_LIMIT_DAYS//365), 
-                InlineKeyboardMarkup(keyboard)
+                update, context, 'capsules',
+                t(lang, 'date_too_far', days=FREE_TIME_LIMIT_DAYS, years=PREMIUM_TIME_LIMIT_DAYS//365),
+                _upgrade_keyboard(lang, 'upgrade_subscription')
             )
             return SELECTING_ACTION
 
-        context.user_data['capsule']['delivery_time'] = prefill_delivery_time
+        capsule.delivery_time = prefill_delivery_time
         logger.info(f"Prefill delivery time used: {prefill_delivery_time} for user {user.id}")
 
         return await ask_for_recipient(update, context)
 
-    # Build keyboard based on subscription status (normal flow)
-    keyboard = [
-        [InlineKeyboardButton(t(lang, 'time_1hour'), callback_data='time_1h'),
-         InlineKeyboardButton(t(lang, 'time_1day'), callback_data='time_1d')],
-        [InlineKeyboardButton(t(lang, 'time_1week'), callback_data='time_1w'),
-         InlineKeyboardButton(t(lang, 'time_1month'), callback_data='time_1m')],
-        [InlineKeyboardButton(t(lang, 'time_3months'), callback_data='time_3m'),
-         InlineKeyboardButton(t(lang, 'time_6months'), callback_data='time_6m')],
-        [InlineKeyboardButton(t(lang, 'time_1year'), callback_data='time_1y')]
-    ]
-
-    keyboard.extend([
-        [InlineKeyboardButton(t(lang, 'time_custom'), callback_data='time_custom')],
-        [InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]
-    ])
-
-    await send_menu_with_image(update, context, 'capsules', t(lang, 'select_time'), InlineKeyboardMarkup(keyboard))
+    # Normal flow
+    await send_menu_with_image(update, context, 'capsules', t(lang, 'select_time'), _time_keyboard(lang))
     return SELECTING_TIME
 
 
@@ -256,52 +495,34 @@ async def select_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
     lang = user_data['language_code']
     time_option = query.data.replace('time_', '')
 
     if time_option == 'custom':
-        keyboard = [[InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]]
-        await send_menu_with_image(update, context, 'capsules', t(lang, 'enter_date'), InlineKeyboardMarkup(keyboard))
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'enter_date'), _single_button_keyboard(lang, 'cancel', 'cancel'))
         return SELECTING_DATE
 
-    now = datetime.now(timezone.utc)
-    delivery_time = now
+    offset = TIME_DELTAS.get(time_option)
+    if offset is None:
+        # Stale or unknown button - stay on the time menu
+        logger.warning(f"Unknown time option {time_option!r} from user {user.id}")
+        return SELECTING_TIME
 
     # Calculate delivery time based on selection
-    if time_option == '1h':
-        delivery_time = now + timedelta(hours=1)
-    elif time_option == '1d':
-        delivery_time = now + timedelta(days=1)
-    elif time_option == '1w':
-        delivery_time = now + timedelta(weeks=1)
-    elif time_option == '1m':
-        delivery_time = now + relativedelta(months=1)
-    elif time_option == '3m':
-        delivery_time = now + relativedelta(months=3)
-    elif time_option == '6m':
-        delivery_time = now + relativedelta(months=6)
-    elif time_option == '1y':
-        delivery_time = now + relativedelta(years=1)
-    elif time_option == '5y':
-        delivery_time = now + relativedelta(years=5)
-    elif time_option == '10y':
-        delivery_time = now + relativedelta(years=10)
-    elif time_option == '25y':
-        delivery_time = now + relativedelta(years=25)
+    now = datetime.now(timezone.utc)
+    delivery_time = add_months(now, offset) if isinstance(offset, int) else now + offset
 
     # Validate time limits based on subscription
     max_days = PREMIUM_TIME_LIMIT_DAYS if user_data['subscription_status'] == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
     if (delivery_time - now).days > max_days:
-        keyboard = [[InlineKeyboardButton(t(lang, 'upgrade_premium'), callback_data='subscription')],
-                    [InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')]]
-        await send_menu_with_image(update, context, 'capsules', t(lang, 'time_limit_exceeded'), InlineKeyboardMarkup(keyboard))
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'time_limit_exceeded'), _upgrade_keyboard(lang, 'upgrade_premium'))
         return SELECTING_ACTION
 
-    context.user_data['capsule']['delivery_time'] = delivery_time
+    capsule = _draft(context)
+    capsule.delivery_time = delivery_time
     # Clear any prefill delivery time if user chose a time option
-    if 'prefill_delivery_time' in context.user_data['capsule']:
-        del context.user_data['capsule']['prefill_delivery_time']
+    capsule.prefill_delivery_time = None
     logger.info(f"Delivery time set: {delivery_time} for user {user.id}")
 
     return await ask_for_recipient(update, context)
@@ -310,8 +531,7 @@ async def select_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def select_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle custom date input with timezone support"""
     message = update.message
-    user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
     lang = user_data['language_code']
     user_timezone = user_data.get('timezone', 'UTC')
 
@@ -320,14 +540,8 @@ async def select_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
         date_str = message.text.strip()
 
         try:
-            # Import timezone utilities
-            from ..timezone_utils import convert_local_to_utc
-            from datetime import datetime
-            import re
-
             # Parse date format DD.MM.YYYY HH:MM (the format mentioned in translations)
-            date_pattern = r'^(\d{2})\.(\d{2})\.(\d{4})\s+(\d{2}):(\d{2})$'
-            match = re.match(date_pattern, date_str)
+            match = _DATE_RE.match(date_str)
 
             if not match:
                 await message.reply_text(t(lang, 'invalid_date'))
@@ -346,7 +560,6 @@ async def select_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 return SELECTING_DATE
 
             # Check if date is too far in the future based on user's subscription
-            from ..config import FREE_TIME_LIMIT_DAYS, PREMIUM_TIME_LIMIT_DAYS, PREMIUM_TIER
             max_days = PREMIUM_TIME_LIMIT_DAYS if user_data.get('subscription_status') == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
 
             max_allowed_date = now_utc + timedelta(days=max_days)
@@ -360,10 +573,10 @@ async def select_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 )
                 return SELECTING_DATE
 
-            context.user_data['capsule']['delivery_time'] = delivery_time
+            capsule = _draft(context)
+            capsule.delivery_time = delivery_time
             # Clear any prefill delivery time if user chose custom date
-            if 'prefill_delivery_time' in context.user_data['capsule']:
-                del context.user_data['capsule']['prefill_delivery_time']
+            capsule.prefill_delivery_time = None
             logger.info(f"Custom delivery time set: {delivery_time} (user's local: {local_delivery_time} in {user_timezone})")
 
             return await ask_for_recipient(update, context)
@@ -388,34 +601,37 @@ async def select_custom_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def ask_for_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Ask the user to specify the recipient."""
     user = update.effective_user
-    user_data = get_user_data(user.id)
-    lang = user_data['language_code']
+    lang = current_lang.get()
     
     # Check if prefill recipient is available (from ideas module)
-    prefill_recipient = context.user_data.get('capsule', {}).get('prefill_recipient')
+    capsule = _draft(context)
+    prefill_recipient = capsule.prefill_recipient
     
     if prefill_recipient == 'self':
         # If prefill recipient is 'self', use it directly
-        context.user_data['capsule']['recipient_type'] = 'self'
-        context.user_data['capsule']['recipient_id'] = user.id
+        capsule.recipient_type = 'self'
+        capsule.recipient_id = user.id
         logger.info(f"Prefill recipient 'self' used for user {user.id}")
         return await show_confirmation(update, context)
 
-    keyboard = [
-        [InlineKeyboardButton(t(lang, 'recipient_self'), callback_data='recipient_self')],
-        [InlineKeyboardButton(t(lang, 'cancel'), callback_data='cancel')]
-    ]
-
-    await send_menu_with_image(update, context, 'capsules', t(lang, 'forward_prompt'), InlineKeyboardMarkup(keyboard))
+    await send_menu_with_image(update, context, 'capsules', t(lang, 'forward_prompt'), _recipient_keyboard(lang))
     return PROCESSING_RECIPIENT
 
 
+def _parse_chat_id(text: str) -> Optional[int]:
+    """Chat ID typed by the user, or None if the text is not an integer"""
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
 async def process_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Process the user's recipient choice (@username or forwarded message)."""
     message = update.message
     user = update.effective_user
-    user_data = get_user_data(user.id)
-    lang = user_data['language_code']
+    lang = current_lang.get()
+    capsule = _draft(context)
 
     # FIXED: Use the new method to detect forwarded messages in v20+
     # Check multiple ways to detect chat selection
@@ -462,10 +678,10 @@ async def process_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     logger.warning(f"Bot cannot post in channel {chat_to_send.id}")
                     await message.reply_text(t(lang, 'no_post_rights', chat_title=getattr(chat_to_send, 'title', 'Unknown')))
                     return PROCESSING_RECIPIENT
-                context.user_data['capsule']['recipient_type'] = 'channel'
+                capsule.recipient_type = 'channel'
             else:
                 # For groups, bot just needs to be a member
-                context.user_data['capsule']['recipient_type'] = 'group'
+                capsule.recipient_type = 'group'
 
         except BadRequest as e:
             logger.warning(f"Bot access issue for chat {chat_to_send.id}: {e}")
@@ -476,8 +692,8 @@ async def process_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await message.reply_text(t(lang, 'error_occurred'))
             return PROCESSING_RECIPIENT
 
-        context.user_data['capsule']['recipient_id'] = chat_to_send.id
-        context.user_data['capsule']['recipient_name'] = getattr(chat_to_send, 'title', f"Chat {chat_to_send.id}")
+        capsule.recipient_id = chat_to_send.id
+        capsule.recipient_name = getattr(chat_to_send, 'title', f"Chat {chat_to_send.id}")
         return await show_confirmation(update, context)
 
     # Case 2: User sent a username
@@ -487,34 +703,34 @@ async def process_recipient(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await message.reply_text(t(lang, 'invalid_username'))
             return PROCESSING_RECIPIENT
 
-        context.user_data['capsule']['recipient_type'] = 'user'
-        context.user_data['capsule']['recipient_username'] = username
-        context.user_data['capsule']['recipient_id'] = None  # Will be resolved when user starts bot
+        capsule.recipient_type = 'user'
+        capsule.recipient_username = username
+        capsule.recipient_id = None  # Will be resolved when user starts bot
         logger.info(f"Capsule for @{username} - will activate when they start bot")
         return await show_confirmation(update, context)
 
     # Case 3: User typed chat ID directly (for advanced users)
-    elif message and message.text and message.text.lstrip('-').isdigit():
+    elif message and message.text and (chat_id := _parse_chat_id(message.text)) is not None:
         try:
-            chat_id = int(message.text)
-            chat_info = await context.bot.get_chat(chat_id)
-
-            # Check bot permissions
-            bot_member = await context.bot.get_chat_member(chat_id, context.bot.id)
+            # Chat details and the bot's permissions are independent requests
+            chat_info, bot_member = await asyncio.gather(
+                context.bot.get_chat(chat_id),
+                context.bot.get_chat_member(chat_id, context.bot.id)
+            )
 
             if chat_info.type == 'channel':
                 if not (hasattr(bot_member, 'can_post_messages') and bot_member.can_post_messages):
                     await message.reply_text(t(lang, 'no_post_rights', chat_title=getattr(chat_info, 'title', 'Unknown')))
                     return PROCESSING_RECIPIENT
-                context.user_data['capsule']['recipient_type'] = 'channel'
+                capsule.recipient_type = 'channel'
             else:
-                context.user_data['capsule']['recipient_type'] = 'group'
+                capsule.recipient_type = 'group'
 
-            context.user_data['capsule']['recipient_id'] = chat_id
-            context.user_data['capsule']['recipient_name'] = getattr(chat_info, 'title', f"Chat {chat_id}")
+            capsule.recipient_id = chat_id
+            capsule.recipient_name = getattr(chat_info, 'title', f"Chat {chat_id}")
             return await show_confirmation(update, context)
 
-        except (ValueError, BadRequest) as e:
+        except BadRequest as e:
             logger.warning(f"Invalid chat ID {message.text} from user {user.id}: {e}")
             await message.reply_text(t(lang, 'invalid_chat_id'))
             return PROCESSING_RECIPIENT
@@ -531,8 +747,9 @@ async def process_self_recipient(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     user = update.effective_user
 
-    context.user_data['capsule']['recipient_type'] = 'self'
-    context.user_data['capsule']['recipient_id'] = user.id
+    capsule = _draft(context)
+    capsule.recipient_type = 'self'
+    capsule.recipient_id = user.id
     logger.info(f"Recipient set to self for user {user.id}")
     return await show_confirmation(update, context)
 
@@ -544,25 +761,25 @@ async def process_self_recipient(update: Update, context: ContextTypes.DEFAULT_T
 async def show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show capsule confirmation"""
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
     lang = user_data['language_code']
-    capsule = context.user_data.get('capsule', {})
+    capsule = _draft(context)
 
     # Format recipient display
     recipient_text = ""
-    recipient_type = capsule.get('recipient_type')
+    recipient_type = capsule.recipient_type
 
     if recipient_type == "self":
         recipient_text = t(lang, "recipient_self")
     elif recipient_type == "user":
-        recipient_text = f"@{capsule.get('recipient_username', 'Unknown')}"
+        recipient_text = f"@{capsule.recipient_username or 'Unknown'}"
     elif recipient_type in ("group", "channel"):
-        recipient_text = f"{capsule.get('recipient_name', 'Unknown')}"
+        recipient_text = f"{capsule.recipient_name or 'Unknown'}"
 
     # FIXED: Format time display using user's timezone with proper error handling
     try:
         user_timezone = user_data.get('timezone', 'UTC')
-        delivery_time = capsule['delivery_time']
+        delivery_time = capsule.delivery_time
         
         # Ensure timezone awareness
         if delivery_time.tzinfo is None:
@@ -572,126 +789,146 @@ async def show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         logger.error(f"Error formatting time for user {user.id}: {e}")
         # Fallback to simple formatting
-        time_text = capsule['delivery_time'].strftime('%d.%m.%Y %H:%M UTC')
+        time_text = capsule.delivery_time.strftime('%d.%m.%Y %H:%M UTC')
 
     # Format content type
-    content_type_display = t(lang, f"content_{capsule.get('content_type', 'unknown')}")
-
-    keyboard = [
-        [InlineKeyboardButton(t(lang, "confirm_yes"), callback_data="confirm_yes")],
-        [InlineKeyboardButton(t(lang, "confirm_no"), callback_data="cancel")]
-    ]
+    content_type = capsule.content_type or 'unknown'
+    content_type_display = _content_type_names(lang).get(content_type) or t(lang, f"content_{content_type}")
 
     confirmation_text = t(lang, "confirm_capsule",
                          type=content_type_display,
                          time=time_text,
                          recipient=recipient_text)
 
-    await send_menu_with_image(update, context, 'capsules', confirmation_text, InlineKeyboardMarkup(keyboard))
+    await send_menu_with_image(update, context, 'capsules', confirmation_text, _confirm_keyboard(lang))
     return CONFIRMING_CAPSULE
 
 
+# Statements of the confirm transaction, built once; values are passed as
+# parameters so every call reuses the same cached compiled SQL
+
+# capsule_uuid comes from the column default and is read back in the same round-trip
+_INSERT_CAPSULE_STMT = insert(capsules).returning(capsules.c.capsule_uuid)
+
+# Charges one capsule only while the balance is positive; no row comes back
+# otherwise, so concurrent confirms cannot overdraw the balance
+_CHARGE_USER_STMT = (
+    sqlalchemy_update(users)
+    .where(
+        users.c.id == bindparam('user_id'),
+        users.c.capsule_balance > 0,
+        # Re-checked here, as the quota check on upload read a cached row
+        users.c.total_storage_used + bindparam('added_size') <= bindparam('storage_limit')
+    )
+    .values(
+        capsule_balance=users.c.capsule_balance - 1,
+        capsule_count=users.c.capsule_count + 1,
+        total_storage_used=users.c.total_storage_used + bindparam('added_size')
+    )
+    .returning(users.c.id)
+)
+
+
+def _insert_capsule_sync(userdata: dict, capsule: CapsuleDraft) -> Optional[str]:
+    """Insert the capsule and charge the user in one transaction (blocking).
+    Returns the new capsule's UUID, or None if the user has no capsules left
+    or the file no longer fits in their storage quota"""
+    recipient_id_value = capsule.recipient_id
+    with engine.begin() as conn:
+        # Charge the user first; the insert below only runs if that succeeded
+        charged = conn.execute(
+            _CHARGE_USER_STMT, {
+                'user_id': userdata['id'],
+                'added_size': capsule.file_size,
+                'storage_limit': _storage_limit(userdata),
+            }
+        ).first()
+        if charged is None:
+            return None
+
+        # Insert capsule - REMOVED needs_activation field
+        capsule_uuid = conn.execute(_INSERT_CAPSULE_STMT, {
+            'user_id': userdata['id'],
+            'content_type': capsule.content_type,
+            'content_text': capsule.content_text,
+            'file_key': capsule.file_key,
+            's3_key': capsule.s3_key,
+            'file_size': capsule.file_size,
+            'recipient_type': capsule.recipient_type,
+            'recipient_id': str(recipient_id_value) if recipient_id_value else None,
+            'recipient_username': capsule.recipient_username,
+            'delivery_time': capsule.delivery_time,
+            'delivered': False,
+            'created_at': datetime.now(timezone.utc),
+        }).scalar_one()
+    return capsule_uuid
+
+
 async def confirm_capsule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Create the capsule in the database."""
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    userdata = get_user_data(user.id)
+    userdata = await load_user_data(update, context)
     lang = userdata['language_code']
-    capsule_data = context.user_data.get('capsule', {})
+    capsule = _draft(context)
 
     # Validate capsule data
-    if not capsule_data.get('delivery_time') or not capsule_data.get('content_type'):
-        logger.error(f"Invalid capsule data for user {user.id}: {capsule_data}")
-        keyboard = [[InlineKeyboardButton(t(lang, 'main_menu'), callback_data='main_menu')]]
-        await send_menu_with_image(update, context, 'capsules', t(lang, 'error_occurred'), InlineKeyboardMarkup(keyboard))
+    if not capsule.delivery_time or not capsule.content_type:
+        logger.error(f"Invalid capsule data for user {user.id}: {capsule}")
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'error_occurred'), _single_button_keyboard(lang, 'main_menu', 'main_menu'))
         return SELECTING_ACTION
 
-    capsule_uuid = str(uuid.uuid4())
-    recipient_id_value = capsule_data.get('recipient_id')
-    recipient_username_value = capsule_data.get('recipient_username')
-    recipient_type = capsule_data['recipient_type']
+    recipient_username_value = capsule.recipient_username
+    recipient_type = capsule.recipient_type
 
-    # Database transaction
-    with engine.connect() as conn:
-        trans = conn.begin()
-        try:
-            # Check user balance again
-            user_check = conn.execute(select(users.c.capsule_balance).where(users.c.id == userdata['id'])).first()
-            if not user_check or user_check.capsule_balance <= 0:
-                trans.rollback()
-                keyboard = [[InlineKeyboardButton(t(lang, 'buy_capsules'), callback_data='subscription')],
-                           [InlineKeyboardButton(t(lang, 'main_menu'), callback_data='main_menu')]]
-                await send_menu_with_image(update, context, 'capsules', t(lang, 'insufficient_balance'), InlineKeyboardMarkup(keyboard))
-                return SELECTING_ACTION
-
-            # Insert capsule - REMOVED needs_activation field
-            conn.execute(
-                insert(capsules).values(
-                    user_id=userdata['id'],
-                    capsule_uuid=capsule_uuid,
-                    content_type=capsule_data['content_type'],
-                    content_text=capsule_data.get('content_text'),
-                    file_key=capsule_data.get('file_key'),
-                    s3_key=capsule_data.get('s3_key'),
-                    file_size=capsule_data.get('file_size', 0),
-                    recipient_type=recipient_type,
-                    recipient_id=str(recipient_id_value) if recipient_id_value else None,
-                    recipient_username=recipient_username_value,
-                    delivery_time=capsule_data['delivery_time'],
-                    delivered=False,
-                    created_at=datetime.now(timezone.utc)
-                )
-            )
-
-            # Update user stats
-            conn.execute(
-                sqlalchemy_update(users)
-                .where(users.c.id == userdata['id'])
-                .values(
-                    capsule_balance=users.c.capsule_balance - 1,
-                    total_storage_used=users.c.total_storage_used + capsule_data.get('file_size', 0)
-                )
-            )
-
-            trans.commit()
-            logger.info(f"Capsule {capsule_uuid} created successfully for user {user.id}")
+    # Database transaction - the commit is the boundary: nothing after it may
+    # report the capsule as failed
+    try:
+        capsule_uuid = await run_db(_insert_capsule_sync, userdata, capsule)
+        # Balance and storage just changed (or were re-read); drop the cached row
+        invalidate_user_cache(context)
+    except SQLAlchemyError as e:
+        logger.error(f"Error creating capsule for user {user.id}: {e}")
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'error_occurred'), _single_button_keyboard(lang, 'main_menu', 'main_menu'))
+        return SELECTING_ACTION
 
-        except Exception as e:
-            trans.rollback()
-            logger.error(f"Error creating capsule for user {user.id}: {e}")
-            keyboard = [[InlineKeyboardButton(t(lang, 'main_menu'), callback_data='main_menu')]]
-            await send_menu_with_image(update, context, 'capsules', t(lang, 'error_occurred'), InlineKeyboardMarkup(keyboard))
+    if capsule_uuid is None:
+        # Re-read the row to tell which guard of the charge failed
+        userdata = await load_user_data(update, context)
+        if userdata['capsule_balance'] > 0:
+            await send_menu_with_image(update, context, 'capsules', _storage_limit_text(lang, userdata), _upgrade_keyboard(lang, 'upgrade_subscription'))
             return SELECTING_ACTION
+        await send_menu_with_image(update, context, 'capsules', t(lang, 'insufficient_balance'), _buy_capsules_keyboard(lang, 'main_menu'))
+        return SELECTING_ACTION
+
+    logger.info(f"Capsule {capsule_uuid} created successfully for user {user.id}")
 
     # Generate success message with user's local time
-    from ..timezone_utils import format_time_for_user
     user_timezone = userdata.get('timezone', 'UTC')
-    delivery_time_str = format_time_for_user(capsule_data['delivery_time'], user_timezone, lang)
+    delivery_time_str = format_time_for_user(capsule.delivery_time, user_timezone, lang)
 
     # Check if this is a username recipient (needs activation)
     needs_activation = (recipient_type == 'user' and recipient_username_value)
 
-    if needs_activation:
-        # Generate invite link for username recipients
-        bot_info = await context.bot.get_me()
-        encoded_uuid = base64.urlsafe_b64encode(capsule_uuid.encode()).decode().rstrip('=')
-        invite_link = f"https://t.me/{bot_info.username}?start=c_{encoded_uuid}"
-        success_text = t(lang, 'capsule_created_with_link',
-                        time=delivery_time_str,
-                        username=f"@{recipient_username_value}",
-                        invite_link=invite_link)
-    elif recipient_type in ('group', 'channel'):
+    if recipient_type in ('group', 'channel'):
         success_text = t(lang, 'capsule_for_group_created',
-                        group_name=capsule_data.get('recipient_name', ''),
+                        group_name=capsule.recipient_name or '',
                         delivery_time=delivery_time_str)
     else:
         success_text = t(lang, 'capsule_created', time=delivery_time_str)
 
-    keyboard = [[InlineKeyboardButton(t(lang, 'main_menu'), callback_data='main_menu')]]
+    if needs_activation:
+        # Generate invite link for username recipients; the bot's username
+        # was fetched once by Application.initialize(), so no API call here
+        invite_link = f"https://t.me/{context.bot.username}?start=c_{capsule_invite_token(capsule_uuid)}"
+        success_text = t(lang, 'capsule_created_with_link',
+                        time=delivery_time_str,
+                        username=f"@{recipient_username_value}",
+                        invite_link=invite_link)
 
     # FIXED: Use send_menu_with_image instead of edit_message_text to avoid "no text to edit" error
-    await send_menu_with_image(update, context, 'capsules', success_text, InlineKeyboardMarkup(keyboard))
+    await send_menu_with_image(update, context, 'capsules', success_text, _single_button_keyboard(lang, 'main_menu', 'main_menu'))
 
     # Clean up user data
     context.user_data.pop('capsule', None)
@@ -715,22 +952,18 @@ async def cancel_creation(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if query:
         await query.answer()
 
-    user = update.effective_user
-    user_data = get_user_data(user.id)
-    lang = user_data['language_code']
+    lang = current_lang.get()
 
     # Clean up any uploaded files if creation was cancelled
-    capsule_data = context.user_data.get('capsule', {})
-    if capsule_data.get('s3_key'):
-        try:
-            from ..s3_utils import delete_from_s3
-            delete_from_s3(capsule_data['s3_key'])
-            logger.info(f"Cleaned up S3 file {capsule_data['s3_key']} for cancelled capsule")
-        except Exception as e:
-            logger.warning(f"Failed to clean up S3 file: {e}")
+    capsule = _draft(context)
+    if capsule.s3_key:
+        # Removed in the background so the reply does not wait on S3
+        schedule_s3_delete(capsule.s3_key)
+        logger.info(f"Scheduled cleanup of S3 file {capsule.s3_key} for cancelled capsule")
 
     # Clean up user data
     context.user_data.pop('capsule', None)
+    invalidate_user_cache(context)
     
     # Also clean up any prefill data set by ideas module to avoid conflicts in future uses
     if 'prefill_text' in context.user_data:
@@ -742,13 +975,13 @@ async def cancel_creation(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if 'prefill_delivery_iso' in context.user_data:
         del context.user_data['prefill_delivery_iso']
 
-    keyboard = [[InlineKeyboardButton(t(lang, 'main_menu'), callback_data='main_menu')]]
+    keyboard = _single_button_keyboard(lang, 'main_menu', 'main_menu')
     message_text = t(lang, 'creation_cancelled')
 
     if query:
         # FIXED: Use send_menu_with_image instead of edit_message_text
-        await send_menu_with_image(update, context, 'capsules', message_text, InlineKeyboardMarkup(keyboard))
+        await send_menu_with_image(update, context, 'capsules', message_text, keyboard)
     else:
-        await update.message.reply_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        await update.message.reply_text(message_text, reply_markup=keyboard)
 
     return SELECTING_ACTION
\ No newline at end of file
@@ -1,9 +1,8 @@
 # src/handlers/delete_capsule.py
 from telegram import Update
 from telegram.ext import ContextTypes
-from sqlalchemy import select
-from ..database import engine, capsules, delete_capsule as db_delete_capsule
-from ..s3_utils import delete_file_from_s3
+from ..database import delete_capsule as db_delete_capsule, run_db
+from ..s3_utils import schedule_s3_delete
 from ..translations import t
 from .view_capsules import show_capsules
 from ..image_menu import send_menu_with_image
@@ -13,36 +12,27 @@ async def delete_capsule_handler(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
 
-    capsule_id = int(query.data.split('_')[1])
+    capsule_id = int(query.data.removeprefix('delete_'))
 
     try:
-        with engine.connect() as conn:
-            # Get capsule data to check for S3 key
-            capsule_data = conn.execute(
-                select(capsules.c.s3_key)
-                .where(capsules.c.id == capsule_id)
-            ).first()
+        # Delete from database in the DB thread pool, off the event loop
+        s3_key = await run_db(db_delete_capsule, capsule_id)
 
-            if capsule_data and capsule_data.s3_key:
-                delete_file_from_s3(capsule_data.s3_key)
+        if s3_key:
+            # Removed from S3 in the background, batched with other deletes
+            schedule_s3_delete(s3_key)
 
-            # Delete from database
-            db_delete_capsule(capsule_id)
-
-            # Show updated capsule list
-            return await show_capsules(update, context)
+        # Show updated capsule list
+        return await show_capsules(update, context)
 
     except Exception as e:
-        # Handle error
+        # Handle error - edit the message the way its type allows, in one call
         user_data = context.user_data
         lang = user_data.get('language_code', 'en')
-        try:
+        if query.message.text is not None:
             await query.edit_message_text(t(lang, "error_occurred"))
-        except Exception:
-            # Fallback if edit_message_text fails (e.g., original message has no text)
-            try:
-                await query.edit_message_caption(caption=t(lang, "error_occurred"))
-            except Exception:
-                # If both fail, send a new message
-                await query.message.reply_text(t(lang, "error_occurred"))
+        elif query.message.caption is not None:
+            await query.edit_message_caption(caption=t(lang, "error_occurred"))
+        else:
+            await query.message.reply_text(t(lang, "error_occurred"))
         return -1
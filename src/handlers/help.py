@@ -1,25 +1,29 @@
 # src/handlers/help.py
+from functools import lru_cache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from ..database import get_user_data
 from ..image_menu import send_menu_with_image
 from ..translations import t
+from .user_context import current_lang
+
+@lru_cache(maxsize=None)
+def _help_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Back to main menu button under the help text"""
+    return InlineKeyboardMarkup([[
+            InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')
+        ]])
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /help command"""
-    user = update.effective_user
-    user_data = get_user_data(user.id)
-    lang = user_data['language_code'] if user_data else 'en'
+    # Resolved once per update by populate_user_context
+    lang = current_lang.get()
     help_text = t(lang, 'help_text')
-    keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')
-        ]])
 
     await send_menu_with_image(
         update=update,
         context=context,
         image_key='help',  # Uses assets/help.png
         caption=help_text,
-        keyboard=keyboard,
+        keyboard=_help_keyboard(lang),
         parse_mode='HTML'
     )
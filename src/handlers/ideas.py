@@ -3,13 +3,13 @@
 
 This module follows the project's handler patterns and uses translations via t().
 """
-import re
+from functools import lru_cache
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest
 
-from ..translations import t
+from ..translations import TRANSLATIONS, t
 from ..config import (
     SELECTING_IDEAS_CATEGORY,
     SELECTING_IDEA_TEMPLATE,
@@ -22,7 +22,10 @@ from ..config import (
     logger
 )
 from ..ideas_templates import IDEAS_CATEGORIES, IDEAS_TEMPLATES, dt_in_days, next_new_year, next_morning, next_evening, next_weekend_morning, next_monday_morning, next_birthday_month, _compute_delivery as ideas_templates_compute_delivery
-from ..database import get_user_data, get_or_create_user
+from ..database import get_or_create_user, run_db
+from .create_capsule import start_create_capsule
+from .user_context import invalidate_user_cache, load_user_data
+from .start import show_main_menu_with_image
 
 # Keys in context.user_data used in this flow
 CTX_IDEA_KEY = "idea_key"
@@ -31,11 +34,16 @@ CTX_IDEA_TITLE = "idea_title"
 CTX_IDEA_PRESET_DELIVERY = "idea_preset_delivery"  # datetime
 CTX_IDEA_CONTENT_TYPE = "idea_content_type"
 CTX_IDEA_RECIPIENT = "idea_recipient"
+CTX_IDEA_HINTS = "idea_hints"  # translated hints of the picked template
 
+# Format of a delivery date typed by the user, e.g. 31.12.2025 23:59
+_DATE_FORMAT = '%d.%m.%Y %H:%M'
 
 
 
 
+
+@lru_cache(maxsize=None)
 def _category_keyboard(lang: str) -> InlineKeyboardMarkup:
     rows = []
     for cat_key, meta in IDEAS_CATEGORIES.items():
@@ -46,6 +54,7 @@ def _category_keyboard(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=None)
 def _templates_keyboard(lang: str, cat_key: str) -> InlineKeyboardMarkup:
     rows = []
     meta = IDEAS_CATEGORIES.get(cat_key, {})
@@ -61,6 +70,7 @@ def _templates_keyboard(lang: str, cat_key: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@lru_cache(maxsize=None)
 def _preview_keyboard(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton(t(lang, 'ideas_use_template'), callback_data='ideas_use')],
@@ -70,6 +80,7 @@ def _preview_keyboard(lang: str) -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def _date_edit_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Keyboard for date editing with helpful buttons"""
     return InlineKeyboardMarkup([
@@ -81,6 +92,55 @@ def _date_edit_keyboard(lang: str) -> InlineKeyboardMarkup:
     ])
 
 
+# Categories and templates are static, so every keyboard of the flow is
+# built once per language at import and reused
+for _lang in TRANSLATIONS:
+    _category_keyboard(_lang)
+    _preview_keyboard(_lang)
+    _date_edit_keyboard(_lang)
+    for _cat_key in IDEAS_CATEGORIES:
+        _templates_keyboard(_lang, _cat_key)
+
+
+async def _require_user(update: Update, context: ContextTypes.DEFAULT_TYPE, create: bool = False) -> tuple:
+    """(user_data, lang) for the ideas flow; user_data is None if the user is unknown.
+    With create set, an unregistered user is created first"""
+    user_data = await load_user_data(update, context)
+    if not user_data and create:
+        try:
+            await run_db(get_or_create_user, update.effective_user)
+            invalidate_user_cache(context)
+            user_data = await load_user_data(update, context)
+        except Exception as e:
+            logger.error(f"Failed to create user {update.effective_user.id}: {e}")
+    return user_data, (user_data.get('language_code', 'en') if user_data else 'en')
+
+
+async def _user_missing(update: Update, context: ContextTypes.DEFAULT_TYPE, where: str) -> int:
+    """Fall back to the main menu when the user's data can't be loaded"""
+    user = update.effective_user
+    logger.error(f"User data not found for user {user.id} in {where}")
+    basic_user_data = {'id': user.id, 'language_code': 'en'}
+    return await show_main_menu_with_image(update, context, basic_user_data)
+
+
+async def _edit_or_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str,
+                         reply_markup: InlineKeyboardMarkup = None, parse_mode: str = None) -> None:
+    """Show text in the message whose button was pressed, or reply if it can't be edited.
+    Nothing is sent when that message already shows exactly this content"""
+    message = update.callback_query.message
+    content_key = hash((text, reply_markup, parse_mode))
+    if context.user_data.get('_last_edit') == (message.message_id, content_key):
+        # Same button pressed again - Telegram would reject the edit as not modified
+        return
+    try:
+        sent = await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest:
+        # Message might be too old or have no text (photo menu), send a new one
+        sent = await message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    context.user_data['_last_edit'] = (sent.message_id, content_key)
+
+
 async def show_ideas_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Entry point: show categories of ideas."""
     query = update.callback_query
@@ -91,256 +151,236 @@ async def show_ideas_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         message = update.effective_message
 
     user = update.effective_user
-    user_data = get_user_data(user.id)
-
+    # User might not be registered yet - create them first
+    user_data, lang = await _require_user(update, context, create=True)
     if not user_data:
-        # User might not be registered, try to create user first
-        try:
-            get_or_create_user(user)
-            user_data = get_user_data(user.id)
-        except Exception as e:
-            logger.error(f"Failed to create user {user.id}: {e}")
-
-        if not user_data:
-            logger.error(f"Failed to create/get user data for user {user.id}")
-            # Fallback to main menu
-            from .start import show_main_menu_with_image
-            basic_user_data = {'id': user.id, 'language_code': 'en'}
-            return await show_main_menu_with_image(update, context, basic_user_data)
-
-    lang = user_data.get('language_code', 'en')
+        return await _user_missing(update, context, 'show_ideas_menu')
 
     try:
         text = t(lang, 'ideas_menu_title')
         keyboard = _category_keyboard(lang)
 
         if query:
-            try:
-                await query.message.edit_text(text, reply_markup=keyboard)
-            except BadRequest:
-                # Message might be too old or identical, send a new one
-                await query.message.reply_text(text, reply_markup=keyboard)
+            await _edit_or_reply(update, context, text, keyboard)
         else:
             await message.reply_text(text, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Error showing ideas menu to user {user.id}: {e}")
-        from .start import show_main_menu_with_image
         return await show_main_menu_with_image(update, context, user_data)
 
     return SELECTING_IDEAS_CATEGORY
 
 
-async def ideas_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Route callbacks inside Ideas flow based on callback_data."""
+async def _ideas_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Return to categories"""
+    await _edit_or_reply(update, context, t(lang, 'ideas_menu_title'), _category_keyboard(lang))
+    return SELECTING_IDEAS_CATEGORY
+
+
+async def _show_templates(update: Update, context: ContextTypes.DEFAULT_TYPE, cat_key: str, lang: str) -> int:
+    """Show the templates of a category"""
+    title = t(lang, f'ideas_category_{cat_key}')
+    text = f"{t(lang, 'ideas_select_template_from')} {title}"
+    await _edit_or_reply(update, context, text, _templates_keyboard(lang, cat_key))
+    return SELECTING_IDEA_TEMPLATE
+
+
+async def _ideas_category(update: Update, context: ContextTypes.DEFAULT_TYPE, cat_key: str, lang: str, user_data: dict) -> int:
+    """Category selection"""
+    if cat_key not in IDEAS_CATEGORIES:
+        logger.warning(f"Invalid category key: {cat_key}")
+        return await show_ideas_menu(update, context)
+
+    # Store current category for navigation
+    context.user_data['ideas_current_category'] = cat_key
+    return await _show_templates(update, context, cat_key, lang)
+
+
+async def _ideas_template(update: Update, context: ContextTypes.DEFAULT_TYPE, idea_key: str, lang: str, user_data: dict) -> int:
+    """Template selection"""
+    tpl = IDEAS_TEMPLATES.get(idea_key)
+    if not tpl:
+        logger.warning(f"Idea template not found: {idea_key} for user {update.effective_user.id}")
+        return await show_ideas_menu(update, context)
+
+    hints_key = tpl.get('hints_key')
+
+    # Fill context presets; hints are translated here once so edits don't
+    # have to look the template up again
+    context.user_data.update({
+        CTX_IDEA_KEY: idea_key,
+        CTX_IDEA_TITLE: t(lang, tpl['title_key']),
+        CTX_IDEA_TEXT: t(lang, tpl['text_key']),
+        CTX_IDEA_HINTS: t(lang, hints_key) if hints_key else '',
+        CTX_IDEA_CONTENT_TYPE: tpl.get('content_type', 'text'),
+        CTX_IDEA_RECIPIENT: tpl.get('recipient_preset', 'self'),
+        CTX_IDEA_PRESET_DELIVERY: ideas_templates_compute_delivery(tpl.get('delivery_preset')),
+    })
+
+    return await _show_idea_preview(update, context, lang)
+
+
+async def _ideas_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Edit text request"""
+    await _edit_or_reply(update, context, t(lang, 'ideas_enter_text'))
+    return EDITING_IDEA_CONTENT
+
+
+async def _ideas_edit_date(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Edit date request - shows the date selection menu"""
+    text = f"{t(lang, 'ideas_enter_date')}\n\n{t(lang, 'date_format_example')}"
+    await _edit_or_reply(update, context, text, _date_edit_keyboard(lang))
+    return EDITING_IDEA_DATE
+
+
+async def _ideas_quick_date(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Quick date selection"""
     query = update.callback_query
-    if query:
-        await query.answer()
-    else:
-        logger.warning("ideas_router called without callback query")
-        return SELECTING_ACTION
+    days = int(arg)
 
-    data = query.data if query else ''
-    user = update.effective_user
-    user_data = get_user_data(user.id)
+    # Validate time limits based on subscription
+    max_days = PREMIUM_TIME_LIMIT_DAYS if user_data['subscription_status'] == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
 
-    if not user_data:
-        logger.error(f"User data not found for user {user.id} in ideas_router")
-        from .start import show_main_menu_with_image
-        basic_user_data = {'id': user.id, 'language_code': 'en'}
-        return await show_main_menu_with_image(update, context, basic_user_data)
+    if days > max_days:
+        await query.answer(t(lang, 'date_too_far', days=FREE_TIME_LIMIT_DAYS, years=PREMIUM_TIME_LIMIT_DAYS//365), show_alert=True)
+        return EDITING_IDEA_DATE
 
-    lang = user_data.get('language_code', 'en')
-    logger.error(data)
-    try:
-        # Handle return to categories
-        if data == 'ideas_menu':
-            try:
-                await query.message.edit_text(
-                    t(lang, 'ideas_menu_title'),
-                    reply_markup=_category_keyboard(lang)
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    t(lang, 'ideas_menu_title'),
-                    reply_markup=_category_keyboard(lang)
-                )
-            return SELECTING_IDEAS_CATEGORY
+    new_delivery_time = datetime.now() + timedelta(days=days)
+    context.user_data[CTX_IDEA_PRESET_DELIVERY] = new_delivery_time
 
-        # Handle category selection
-        elif data.startswith('ideas_cat:'):
-            cat_key = data.split(':', 1)[1]
-            if cat_key not in IDEAS_CATEGORIES:
-                logger.warning(f"Invalid category key: {cat_key}")
-                return await show_ideas_menu(update, context)
+    await query.answer(t(lang, 'date_updated_success'))
+    return await _show_idea_preview(update, context, lang)
 
-            title = t(lang, f'ideas_category_{cat_key}')
-            text = f"{t(lang, 'ideas_select_template_from')} {title}"
-            keyboard = _templates_keyboard(lang, cat_key)
 
-            try:
-                await query.message.edit_text(text, reply_markup=keyboard)
-            except BadRequest:
-                await query.message.reply_text(text, reply_markup=keyboard)
-
-            # Store current category for navigation
-            context.user_data['ideas_current_category'] = cat_key
-            return SELECTING_IDEA_TEMPLATE
-
-        # Handle template selection
-        elif data.startswith('ideas_tpl:'):
-            idea_key = data.split(':', 1)[1]
-            tpl = IDEAS_TEMPLATES.get(idea_key)
-            if not tpl:
-                logger.warning(f"Idea template not found: {idea_key} for user {user.id}")
-                return await show_ideas_menu(update, context)
-
-            # Fill context presets
-            context.user_data[CTX_IDEA_KEY] = idea_key
-            context.user_data[CTX_IDEA_TITLE] = t(lang, tpl['title_key'])
-            context.user_data[CTX_IDEA_TEXT] = t(lang, tpl['text_key'])
-            context.user_data[CTX_IDEA_CONTENT_TYPE] = tpl.get('content_type', 'text')
-            context.user_data[CTX_IDEA_RECIPIENT] = tpl.get('recipient_preset', 'self')
-
-            delivery_preset = tpl.get('delivery_preset')
-            context.user_data[CTX_IDEA_PRESET_DELIVERY] = ideas_templates_compute_delivery(delivery_preset)
+async def _ideas_back_to_preview(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Back to preview from date editing"""
+    return await _show_idea_preview(update, context, lang)
 
-            return await _show_idea_preview(update, context, lang)
 
-        # Handle edit text request
-        elif data == 'ideas_edit':
-            try:
-                await query.message.edit_text(t(lang, 'ideas_enter_text'))
-            except BadRequest:
-                await query.message.reply_text(t(lang, 'ideas_enter_text'))
-            return EDITING_IDEA_CONTENT
-
-        # Handle edit date request - FIXED: Show better date selection menu
-        elif data == 'ideas_edit_date':
-            text = f"{t(lang, 'ideas_enter_date')}\n\n{t(lang, 'date_format_example')}"
-            keyboard = _date_edit_keyboard(lang)
-            try:
-                await query.message.edit_text(text, reply_markup=keyboard)
-            except BadRequest:
-                await query.message.reply_text(text, reply_markup=keyboard)
-            return EDITING_IDEA_DATE
+async def _ideas_back(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Back to templates"""
+    cat_key = context.user_data.get('ideas_current_category')
+    if not cat_key:
+        return await show_ideas_menu(update, context)
+    return await _show_templates(update, context, cat_key, lang)
 
-        # Handle quick date selection - NEW FEATURE
-        elif data.startswith('ideas_quick_date:'):
-            days = int(data.split(':', 1)[1])
 
-            # Validate time limits based on subscription
-            max_days = PREMIUM_TIME_LIMIT_DAYS if user_data['subscription_status'] == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
+def _clear_ideas_context(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the ideas flow keys from context.user_data"""
+    for key in [CTX_IDEA_KEY, CTX_IDEA_TEXT, CTX_IDEA_TITLE, CTX_IDEA_HINTS, CTX_IDEA_PRESET_DELIVERY, CTX_IDEA_CONTENT_TYPE, CTX_IDEA_RECIPIENT]:
+        context.user_data.pop(key, None)
+    context.user_data.pop('ideas_current_category', None)
 
-            if days > max_days:
-                await query.answer(t(lang, 'date_too_far', days=FREE_TIME_LIMIT_DAYS, years=PREMIUM_TIME_LIMIT_DAYS//365), show_alert=True)
-                return EDITING_IDEA_DATE
 
-            new_delivery_time = datetime.now() + timedelta(days=days)
-            context.user_data[CTX_IDEA_PRESET_DELIVERY] = new_delivery_time
+async def _ideas_use(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Use template - transition to create flow"""
+    # Prepare context for create flow
+    prefill = {
+        'prefill_text': context.user_data.get(CTX_IDEA_TEXT),
+        'prefill_content_type': context.user_data.get(CTX_IDEA_CONTENT_TYPE, 'text'),
+        'prefill_recipient': context.user_data.get(CTX_IDEA_RECIPIENT, 'self'),
+    }
 
-            await query.answer(t(lang, 'date_updated_success'))
-            return await _show_idea_preview(update, context, lang)
+    # Store delivery datetime as ISO string for create flow
+    dt = context.user_data.get(CTX_IDEA_PRESET_DELIVERY)
+    if dt:
+        prefill['prefill_delivery_iso'] = dt.isoformat()
+    context.user_data.update(prefill)
 
-        # Handle back to preview from date editing
-        elif data == 'ideas_back_to_preview':
-            return await _show_idea_preview(update, context, lang)
+    # Clear ideas context
+    _clear_ideas_context(context)
 
-        # Handle back to templates
-        elif data == 'ideas_back':
-            cat_key = context.user_data.get('ideas_current_category')
-            if not cat_key:
-                return await show_ideas_menu(update, context)
+    # Jump to create flow
+    return await start_create_capsule(update, context)
 
-            title = t(lang, f'ideas_category_{cat_key}')
-            text = f"{t(lang, 'ideas_select_template_from')} {title}"
-            keyboard = _templates_keyboard(lang, cat_key)
 
-            try:
-                await query.message.edit_text(text, reply_markup=keyboard)
-            except BadRequest:
-                await query.message.reply_text(text, reply_markup=keyboard)
-            return SELECTING_IDEA_TEMPLATE
-
-        # Handle use template - transition to create flow
-        elif data == 'ideas_use':
-            # Prepare context for create flow
-            context.user_data['prefill_text'] = context.user_data.get(CTX_IDEA_TEXT)
-            context.user_data['prefill_content_type'] = context.user_data.get(CTX_IDEA_CONTENT_TYPE, 'text')
-            context.user_data['prefill_recipient'] = context.user_data.get(CTX_IDEA_RECIPIENT, 'self')
-
-            # Store delivery datetime as ISO string for create flow
-            dt = context.user_data.get(CTX_IDEA_PRESET_DELIVERY)
-            if dt:
-                context.user_data['prefill_delivery_iso'] = dt.isoformat()
-
-            # Clear ideas context
-            for key in [CTX_IDEA_KEY, CTX_IDEA_TEXT, CTX_IDEA_TITLE, CTX_IDEA_PRESET_DELIVERY, CTX_IDEA_CONTENT_TYPE, CTX_IDEA_RECIPIENT]:
-                context.user_data.pop(key, None)
-            context.user_data.pop('ideas_current_category', None)
-
-            # Jump to create flow
-            from .create_capsule import start_create_capsule
-            return await start_create_capsule(update, context)
-
-        # Handle fallback cases
-        elif data in ('main_menu', 'cancel'):
-            # Clean up ideas context before going to main menu
-            for key in [CTX_IDEA_KEY, CTX_IDEA_TEXT, CTX_IDEA_TITLE, CTX_IDEA_PRESET_DELIVERY, CTX_IDEA_CONTENT_TYPE, CTX_IDEA_RECIPIENT]:
-                context.user_data.pop(key, None)
-            context.user_data.pop('ideas_current_category', None)
-
-            from .start import show_main_menu_with_image
-            return await show_main_menu_with_image(update, context, user_data)
-
-        # Unknown callback data
-        else:
+async def _ideas_exit(update: Update, context: ContextTypes.DEFAULT_TYPE, arg: str, lang: str, user_data: dict) -> int:
+    """Leave the ideas flow for the main menu"""
+    # Clean up ideas context before going to main menu
+    _clear_ideas_context(context)
+
+    return await show_main_menu_with_image(update, context, user_data)
+
+
+# callback_data is '<action>' or '<action>:<argument>'; the action picks the handler
+_IDEAS_ACTIONS = {
+    'ideas_menu': _ideas_menu,
+    'ideas_cat': _ideas_category,
+    'ideas_tpl': _ideas_template,
+    'ideas_edit': _ideas_edit,
+    'ideas_edit_date': _ideas_edit_date,
+    'ideas_quick_date': _ideas_quick_date,
+    'ideas_back_to_preview': _ideas_back_to_preview,
+    'ideas_back': _ideas_back,
+    'ideas_use': _ideas_use,
+    'main_menu': _ideas_exit,
+    'cancel': _ideas_exit,
+}
+
+
+async def ideas_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Route callbacks inside Ideas flow based on callback_data."""
+    query = update.callback_query
+    if query:
+        await query.answer()
+    else:
+        logger.warning("ideas_router called without callback query")
+        return SELECTING_ACTION
+
+    data = query.data if query else ''
+    user = update.effective_user
+    user_data, lang = await _require_user(update, context)
+    if not user_data:
+        return await _user_missing(update, context, 'ideas_router')
+    logger.debug(f"Ideas callback from user {user.id}: {data}")
+    try:
+        action, _, arg = data.partition(':')
+        handler = _IDEAS_ACTIONS.get(action)
+        if handler is None:
+            # Unknown callback data
             logger.warning(f"Unknown callback data in ideas_router: {data}")
             return await show_ideas_menu(update, context)
+        return await handler(update, context, arg, lang, user_data)
 
     except Exception as e:
         logger.error(f"Error in ideas_router for user {user.id}, data: {data}, error: {e}")
         # In case of any error, return to main menu
-        from .start import show_main_menu_with_image
         return await show_main_menu_with_image(update, context, user_data)
 
 
+def _fmt_dt(dt: datetime) -> str:
+    """dt as DD.MM.YYYY HH:MM, without going through strftime"""
+    return f"{dt.day:02d}.{dt.month:02d}.{dt.year} {dt.hour:02d}:{dt.minute:02d}"
+
+
+@lru_cache(maxsize=None)
+def _preview_labels(lang: str) -> tuple:
+    """Bold section labels of the idea preview"""
+    return f"<b>{t(lang, 'ideas_preset_time')}</b>: ", f"<b>{t(lang, 'ideas_hints')}</b>\n"
+
+
+def _render_preview(lang: str, title: str, text: str, when: str, hints: str) -> str:
+    """HTML preview of an idea with its delivery time and hints"""
+    time_label, hints_label = _preview_labels(lang)
+    return ''.join(("<b>", title, "</b>\n\n", text, "\n\n", time_label, when, "\n\n", hints_label, hints))
+
+
 async def _show_idea_preview(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str) -> int:
     """Show the idea preview with current settings"""
     # Compose preview text
     title = context.user_data.get(CTX_IDEA_TITLE, '')
     text_content = context.user_data.get(CTX_IDEA_TEXT, '')
     dt = context.user_data.get(CTX_IDEA_PRESET_DELIVERY, datetime.now() + timedelta(days=30))
-    when = dt.strftime('%d.%m.%Y %H:%M')
-
-    # Retrieve original hints
-    idea_key = context.user_data.get(CTX_IDEA_KEY)
-    hints_key = IDEAS_TEMPLATES.get(idea_key, {}).get('hints_key')
-    hints = t(lang, hints_key) if hints_key else ''
-
-    preview = (
-        f"<b>{title}</b>\n\n"
-        f"{text_content}\n\n"
-        f"<b>{t(lang, 'ideas_preset_time')}</b>: {when}\n\n"
-        f"<b>{t(lang, 'ideas_hints')}</b>\n{hints}"
-    )
+    when = _fmt_dt(dt)
 
-    try:
-        query = update.callback_query
-        if query:
-            await query.message.edit_text(
-                preview,
-                reply_markup=_preview_keyboard(lang),
-                parse_mode='HTML'
-            )
-        else:
-            await update.message.reply_text(
-                preview,
-                reply_markup=_preview_keyboard(lang),
-                parse_mode='HTML'
-            )
-    except BadRequest:
-        # If edit fails, send new message
-        await update.effective_message.reply_text(
+    hints = context.user_data.get(CTX_IDEA_HINTS, '')
+
+    preview = _render_preview(lang, title, text_content, when, hints)
+
+    if update.callback_query:
+        await _edit_or_reply(update, context, preview, _preview_keyboard(lang), parse_mode='HTML')
+    else:
+        await update.message.reply_text(
             preview,
             reply_markup=_preview_keyboard(lang),
             parse_mode='HTML'
@@ -352,15 +392,9 @@ async def _show_idea_preview(update: Update, context: ContextTypes.DEFAULT_TYPE,
 async def ideas_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Capture edited text from user during Ideas flow and return to preview."""
     user = update.effective_user
-    user_data = get_user_data(user.id)
-
+    user_data, lang = await _require_user(update, context)
     if not user_data:
-        logger.error(f"User data not found for user {user.id} in ideas_text_input")
-        from .start import show_main_menu_with_image
-        basic_user_data = {'id': user.id, 'language_code': 'en'}
-        return await show_main_menu_with_image(update, context, basic_user_data)
-
-    lang = user_data.get('language_code', 'en')
+        return await _user_missing(update, context, 'ideas_text_input')
 
     try:
         text = (update.message.text or '').strip()
@@ -373,52 +407,24 @@ async def ideas_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     except Exception as e:
         logger.error(f"Error in ideas_text_input for user {user.id}, error: {e}")
         # Return to main menu in case of error
-        from .start import show_main_menu_with_image
         return await show_main_menu_with_image(update, context, user_data)
 
 
 async def ideas_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle custom date input in Ideas flow - COMPLETELY FIXED."""
     user = update.effective_user
-    user_data = get_user_data(user.id)
-
+    user_data, lang = await _require_user(update, context)
     if not user_data:
-        logger.error(f"User data not found for user {user.id} in ideas_date_input")
-        from .start import show_main_menu_with_image
-        basic_user_data = {'id': user.id, 'language_code': 'en'}
-        return await show_main_menu_with_image(update, context, basic_user_data)
-
-    lang = user_data.get('language_code', 'en')
+        return await _user_missing(update, context, 'ideas_date_input')
     message = update.message
 
     if message and message.text:
         date_str = message.text.strip()
         try:
-            from datetime import datetime, timezone
-
-            # Parse DD.MM.YYYY HH:MM format
-            date_pattern = r'^(\d{1,2})\.(\d{1,2})\.(\d{4})\s+(\d{1,2}):(\d{2})$'
-            match = re.match(date_pattern, date_str)
-
-            if not match:
-                await message.reply_text(
-                    f"{t(lang, 'invalid_date')}\n\n{t(lang, 'date_format_example')}",
-                    reply_markup=_date_edit_keyboard(lang)
-                )
-                return EDITING_IDEA_DATE
-
-            day, month, year, hour, minute = map(int, match.groups())
-
-            # Validate date components
-            if not (1 <= day <= 31 and 1 <= month <= 12 and year >= datetime.now().year and 0 <= hour <= 23 and 0 <= minute <= 59):
-                await message.reply_text(
-                    f"{t(lang, 'invalid_date')}\n\n{t(lang, 'date_format_example')}",
-                    reply_markup=_date_edit_keyboard(lang)
-                )
-                return EDITING_IDEA_DATE
-
+            # Parse DD.MM.YYYY HH:MM format; strptime also rejects
+            # out-of-range components such as 31.02
             try:
-                new_delivery_time = datetime(year, month, day, hour, minute)
+                new_delivery_time = datetime.strptime(date_str, _DATE_FORMAT)
             except ValueError:
                 await message.reply_text(
                     f"{t(lang, 'invalid_date')}\n\n{t(lang, 'date_format_example')}",
@@ -426,8 +432,11 @@ async def ideas_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 )
                 return EDITING_IDEA_DATE
 
+            # One clock reading for both checks
+            now = datetime.now()
+
             # Validate future date
-            if new_delivery_time <= datetime.now():
+            if new_delivery_time <= now:
                 await message.reply_text(
                     f"{t(lang, 'date_must_be_future')}\n\n{t(lang, 'date_format_example')}",
                     reply_markup=_date_edit_keyboard(lang)
@@ -436,7 +445,7 @@ async def ideas_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
             # Check subscription limits
             max_days = PREMIUM_TIME_LIMIT_DAYS if user_data.get('subscription_status') == PREMIUM_TIER else FREE_TIME_LIMIT_DAYS
-            days_diff = (new_delivery_time - datetime.now()).days
+            days_diff = (new_delivery_time - now).days
 
             if days_diff > max_days:
                 limit_text = t(lang, 'date_too_far', days=FREE_TIME_LIMIT_DAYS, years=PREMIUM_TIME_LIMIT_DAYS//365)
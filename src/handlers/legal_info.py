@@ -1,13 +1,15 @@
 # src/handlers/legal_info.py
 
+from functools import lru_cache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from ..database import get_user_data
-from ..translations import t
+from ..translations import TRANSLATIONS, t
 from ..config import MANAGING_LEGAL_INFO, SELECTING_ACTION, SUPPORT_EMAIL, SUPPORT_TELEGRAM_URL, LEGAL_REQUISITES_RU, LEGAL_REQUISITES_EN
 from .main_menu import main_menu_handler
+from .user_context import load_user_data
 from ..image_menu import send_menu_with_image
 
+@lru_cache(maxsize=None)
 def get_legal_info_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Generate legal info menu keyboard"""
     keyboard = [
@@ -22,13 +24,22 @@ def get_legal_info_keyboard(lang: str) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(keyboard)
 
+@lru_cache(maxsize=None)
+def _legal_back_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Back button under a legal document"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(t(lang, 'back'), callback_data='legal_info_menu')]])
+
+# The same markup objects are shared by every user of a language
+for _lang in TRANSLATIONS:
+    get_legal_info_keyboard(_lang)
+    _legal_back_keyboard(_lang)
+
 async def show_legal_info_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show the legal information menu."""
     query = update.callback_query
     await query.answer()
 
-    user_id = update.effective_user.id
-    user_data = get_user_data(user_id)
+    user_data = await load_user_data(update, context)
     lang = user_data.get('language_code', 'en')
     legal_text = t(lang, 'legal_info_title')
     await send_menu_with_image(
@@ -46,8 +57,7 @@ async def legal_info_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    user_id = update.effective_user.id
-    user_data = get_user_data(user_id)
+    user_data = await load_user_data(update, context)
     lang = user_data.get('language_code', 'en')
 
     action = query.data
@@ -82,7 +92,7 @@ async def legal_info_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context=context,
         image_key='legal',  # Uses assets/legal.png
         caption=text,
-        keyboard=InlineKeyboardMarkup([[InlineKeyboardButton(t(lang, 'back'), callback_data='legal_info_menu')]]),
+        keyboard=_legal_back_keyboard(lang),
         parse_mode='HTML'
     )
     return MANAGING_LEGAL_INFO
@@ -1,11 +1,13 @@
 # src/handlers/main_menu.py (patch for Ideas button)
+from functools import lru_cache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from ..database import get_user_data
-from ..translations import t
+from ..translations import TRANSLATIONS, t
 from ..config import SELECTING_ACTION, logger
+from .user_context import load_user_data
 
 
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Generate main menu keyboard"""
     keyboard = [
@@ -24,6 +26,11 @@ def get_main_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(keyboard)
 
 
+# The same markup object is shared by every user of a language
+for _lang in TRANSLATIONS:
+    get_main_menu_keyboard(_lang)
+
+
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle main menu button clicks"""
     from .create_capsule import start_create_capsule
@@ -32,6 +39,7 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     from .settings import show_settings
     from .start import show_main_menu_with_image
     from .legal_info import show_legal_info_menu
+    from .help import help_command
     from .ideas import show_ideas_menu  # NEW
 
     query = update.callback_query
@@ -39,13 +47,12 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.answer()
 
     user = update.effective_user
-    user_data = get_user_data(user.id)
+    user_data = await load_user_data(update, context)
 
     if not user_data:
         logger.error(f"User data not found for {user.id}")
         return SELECTING_ACTION
 
-    lang = user_data['language_code']
     action = query.data if query else None
 
     logger.info(f"Main menu action: {action} from user {user.id}")
@@ -70,31 +77,8 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return await show_legal_info_menu(update, context)
 
     elif action == 'help':
-        # Show help with image, then return to main menu
-        from ..image_menu import send_menu_with_image
-        if query:
-            try:
-                # Delete the current message and send new one with image
-                await query.message.delete()
-                await send_menu_with_image(
-                    update=update,
-                    context=context,
-                    image_key='help',
-                    caption=t(lang, 'help_text'),
-                    keyboard=InlineKeyboardMarkup([[ 
-                        InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')
-                    ]]),
-                    parse_mode='HTML'
-                )
-            except:
-                # Fallback to text-only if image sending fails
-                await query.message.reply_text(
-                    t(lang, 'help_text'),
-                    reply_markup=InlineKeyboardMarkup([[ 
-                        InlineKeyboardButton(t(lang, 'back'), callback_data='main_menu')
-                    ]]),
-                    parse_mode='HTML'
-                )
+        # Same screen as /help, then stay in the main menu state
+        await help_command(update, context)
         return SELECTING_ACTION
 
     elif action in ('main_menu', 'cancel', 'confirm_no'):
@@ -5,6 +5,7 @@ from ..database import get_user_data, update_user_language
 from ..translations import t
 from ..config import SELECTING_ACTION, MANAGING_SETTINGS, logger
 from ..image_menu import send_menu_with_image
+from .user_context import invalidate_user_cache
 
 async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show settings menu"""
@@ -101,6 +102,8 @@ async def language_callback_handler(update: Update, context: ContextTypes.DEFAUL
     lang = "ru" if query.data == "set_lang_ru" else "en"
 
     update_user_language(user.id, lang)
+    # The cached user row still has the old language
+    invalidate_user_cache(context)
 
     # Refresh settings menu
     return await show_settings(update, context)
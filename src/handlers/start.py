@@ -4,15 +4,16 @@ from telegram.ext import ContextTypes, ConversationHandler
 from ..translations import t
 from ..config import SELECTING_LANG, SELECTING_ACTION, logger
 from .main_menu import get_main_menu_keyboard
+from .user_context import invalidate_user_cache
 import os
 from ..image_menu import send_menu_with_image
-import base64
 from ..database import (
     get_or_create_user,
     get_user_data,
     get_pending_capsules_for_user,
     activate_capsule_for_recipient,
     get_user_by_internal_id,
+    capsule_uuid_from_token,
     update_user_language,  # ADD THIS IMPORT
     capsules,
     engine
@@ -61,6 +62,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     # Regular /start flow
     get_or_create_user(user)
+    # The row may have just been created - don't serve a cached lookup
+    invalidate_user_cache(context)
     user_data = get_user_data(user.id)
 
     if not user_data:
@@ -101,18 +104,14 @@ async def handle_capsule_activation(update: Update, context: ContextTypes.DEFAUL
 
     # Ensure user exists
     get_or_create_user(user)
+    # The row may have just been created - don't serve a cached lookup
+    invalidate_user_cache(context)
     user_data = get_user_data(user.id)
     lang = user_data['language_code']
 
     try:
-        # Decode capsule UUID
-        encoded_uuid = param.replace('c_', '')
-        # Add padding if needed
-        padding = 4 - (len(encoded_uuid) % 4)
-        if padding != 4:
-            encoded_uuid += '=' * padding
-
-        capsule_uuid = base64.urlsafe_b64decode(encoded_uuid).decode()
+        # Decode capsule UUID (compact and legacy invite tokens)
+        capsule_uuid = capsule_uuid_from_token(param.replace('c_', ''))
 
         # Activate capsule
         success = activate_capsule_for_recipient(capsule_uuid, user.id)
@@ -163,6 +162,8 @@ async def select_language(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # Update user language
     if update_user_language(user.id, selected_lang):
+        # The cached user row still has the old language
+        invalidate_user_cache(context)
         logger.info(f"User {user.id} selected language: {selected_lang}")
         # Show main menu with image - FIXED: get user_data properly
         user_data = get_user_data(user.id)
@@ -8,6 +8,7 @@ from ..database import (get_user_data, users, payments, transactions, engine,
                         add_capsules_to_balance, record_capsule_transaction)
 from ..translations import t
 from ..image_menu import send_menu_with_image
+from .user_context import invalidate_user_cache
 from ..config import (
     MANAGING_SUBSCRIPTION, SELECTING_ACTION, PREMIUM_TIER, FREE_TIER,
     PREMIUM_STORAGE_LIMIT, FREE_STORAGE_LIMIT,
@@ -587,6 +588,9 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
 
             conn.commit()
 
+        # The cached user row has the old balance and plan
+        invalidate_user_cache(context)
+
         success_msg = t(lang, "payment_success", capsules=capsules_to_add, type=payment_type)
 
         # Use HTML parse mode to avoid markdown parsing issues with charge_id
@@ -0,0 +1,64 @@
+# src/handlers/user_context.py
+"""Per-user state shared by all handlers: the cached user row and the
+language of the update being processed."""
+import time
+from contextvars import ContextVar
+from typing import Optional
+from telegram import Update
+from telegram.ext import ContextTypes
+from ..database import get_user_data, run_db
+
+# How long a user row cached on context.user_data stays valid
+USER_DATA_TTL = 60
+
+# Language of the user behind the update being processed
+current_lang: ContextVar[str] = ContextVar('current_lang', default='en')
+
+
+def fresh_user_cache(context: ContextTypes.DEFAULT_TYPE) -> Optional[dict]:
+    """The cached user row entry, or None if missing or older than USER_DATA_TTL"""
+    # Wall-clock time, since user_data is persisted across restarts
+    cached = context.user_data.get('_user_cache')
+    if cached is not None and time.time() - cached['at'] <= USER_DATA_TTL:
+        return cached
+    return None
+
+
+def cache_user_data(context: ContextTypes.DEFAULT_TYPE, user_data: Optional[dict],
+                    update_id: Optional[int] = None) -> Optional[dict]:
+    """Store a fetched user row on context.user_data and return it, along with
+    the update it was read for. A missing row is not cached, so a user
+    registered right after is seen at once"""
+    if user_data is None:
+        context.user_data.pop('_user_cache', None)
+    else:
+        context.user_data['_user_cache'] = {'at': time.time(), 'data': user_data, 'update_id': update_id}
+    return user_data
+
+
+def invalidate_user_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the cached user row after the user's data has changed"""
+    context.user_data.pop('_user_cache', None)
+
+
+async def load_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE, refresh: bool = False):
+    """Get user data, cached on context.user_data for USER_DATA_TTL seconds.
+    With refresh set, only a row read while processing this same update is
+    reused. Misses are read in the DB thread pool"""
+    cached = fresh_user_cache(context)
+    if cached is not None and refresh and cached.get('update_id') != update.update_id:
+        cached = None
+    if cached is None:
+        user_data = await run_db(get_user_data, update.effective_user.id)
+        return cache_user_data(context, user_data, update.update_id)
+    return cached['data']
+
+
+async def populate_user_context(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Resolve the user's language once per update, before any other handler runs.
+    A stale cache is refilled in the DB thread pool, so the handlers that follow
+    read the user row without blocking the event loop"""
+    user_data = None
+    if update.effective_user:
+        user_data = await load_user_data(update, context)
+    current_lang.set(user_data['language_code'] if user_data else 'en')
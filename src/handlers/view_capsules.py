@@ -1,12 +1,53 @@
 # src/handlers/view_capsules.py
+from functools import lru_cache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from sqlalchemy import select, and_
-from ..database import get_user_data, capsules, engine
+from sqlalchemy import select, func, bindparam
+from ..database import get_user_data, capsules, engine, run_db
 from ..image_menu import send_menu_with_image
 from ..translations import t
+from ..timezone_utils import format_time_for_user
 from ..config import SELECTING_ACTION, VIEWING_CAPSULES, PREMIUM_CAPSULE_LIMIT, FREE_CAPSULE_LIMIT, logger
 
+MAX_LISTED_CAPSULES = 10
+
+# Undelivered capsules of a user, soonest delivery first. Built once so every
+# call hits SQLAlchemy's compiled cache; the window count returns the total
+# number of pending capsules without fetching all of them.
+_ACTIVE_CAPSULES_STMT = (
+    select(
+        capsules.c.id,
+        capsules.c.content_type,
+        capsules.c.recipient_type,
+        capsules.c.delivery_time,
+        capsules.c.created_at,
+        func.count().over().label('total')
+    )
+    .where(capsules.c.user_id == bindparam('user_id'))
+    .where(capsules.c.delivered == False)
+    .order_by(capsules.c.delivery_time)
+    .limit(MAX_LISTED_CAPSULES)
+)
+
+
+def _fetch_active_capsules(user_id: int) -> list:
+    """Load the listed capsules of a user (blocking, run in a worker thread)"""
+    with engine.connect() as conn:
+        return conn.execute(_ACTIVE_CAPSULES_STMT, {'user_id': user_id}).fetchall()
+
+
+@lru_cache(maxsize=None)
+def _main_menu_button(lang: str) -> InlineKeyboardButton:
+    """Back to main menu button, shared by every capsule list"""
+    return InlineKeyboardButton(t(lang, "main_menu"), callback_data="main_menu")
+
+
+@lru_cache(maxsize=None)
+def _main_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
+    """Keyboard with only the main menu button (empty list, errors)"""
+    return InlineKeyboardMarkup([[_main_menu_button(lang)]])
+
+
 async def safe_edit_message(query, text, keyboard):
     """Safely edit message, trying different methods"""
     try:
@@ -34,7 +75,8 @@ async def show_capsules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         await query.answer()
 
     user = update.effective_user
-    userdata = get_user_data(user.id)
+    # Fresh row (the list follows deletes and plan changes), read off the event loop
+    userdata = await run_db(get_user_data, user.id)
 
     if not userdata:
         return SELECTING_ACTION
@@ -42,95 +84,86 @@ async def show_capsules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     lang = userdata['language_code']
 
     try:
-        with engine.connect() as conn:
-            capsule_rows = conn.execute(
-                select(capsules)
-                .where(and_(
-                    capsules.c.user_id == userdata['id'],
-                    capsules.c.delivered == False
-                ))
-                .order_by(capsules.c.delivery_time)
-            ).fetchall()
-
-            keyboard = [[InlineKeyboardButton(t(lang, "main_menu"), callback_data="main_menu")]]
-
-            if not capsule_rows:
-                text = t(lang, "no_capsules")
-            else:
-                is_premium = userdata['subscription_status'] == 'premium'
-                limit = PREMIUM_CAPSULE_LIMIT if is_premium else FREE_CAPSULE_LIMIT
-
-                text = t(lang, "capsule_list", count=len(capsule_rows), limit=limit)
-
-                content_emoji = {
-                    "text": "📝",
-                    "photo": "📷",
-                    "video": "🎥",
-                    "document": "📎",
-                    "voice": "🎙️"
-                }
-
-                capsule_keyboard = []
-                for cap in capsule_rows[:10]:  # Show max 10
-                    cap_dict = dict(cap._mapping)
-                    emoji = content_emoji.get(cap_dict['content_type'], "📦")
-
-                    recipient = cap_dict['recipient_type']
-                    if cap_dict['recipient_type'] == "self":
-                        recipient = t(lang, "recipient_self")
-
-                    # Format time using user's local timezone
-                    from ..timezone_utils import format_time_for_user
-                    user_timezone = userdata.get('timezone', 'UTC')
-                    local_delivery_time_str = format_time_for_user(cap_dict['delivery_time'], user_timezone, lang)
-                    local_created_time_str = format_time_for_user(cap_dict['created_at'], user_timezone, lang)
-
-                    item_text = t(lang, "capsule_item",
-                                emoji=emoji,
-                                type=cap_dict['content_type'],
-                                recipient=recipient,
-                                time=local_delivery_time_str,
-                                created=local_created_time_str)
-
-                    text += f"\n{item_text}"
-
-                    capsule_keyboard.append([
-                        InlineKeyboardButton(
-                            f"{emoji} {format_time_for_user(cap_dict['delivery_time'], user_timezone, lang).split()[1]}",  # Just the time part HH:MM
-                            callback_data=f"view_{cap_dict['id']}"
-                        ),
-                        InlineKeyboardButton(
-                            t(lang, "delete_capsule"),
-                            callback_data=f"delete_{cap_dict['id']}"
-                        )
-                    ])
-
-                keyboard = capsule_keyboard + keyboard
-
-            await send_menu_with_image(
-                update=update,
-                context=context,
-                image_key='capsules',  # Uses assets/capsules.png
-                caption=text,
-                keyboard=InlineKeyboardMarkup(keyboard),
-                parse_mode='HTML'
-            )
+        capsule_rows = await run_db(_fetch_active_capsules, userdata['id'])
+
+        if not capsule_rows:
+            text = t(lang, "no_capsules")
+            keyboard = _main_menu_keyboard(lang)
+        else:
+            is_premium = userdata['subscription_status'] == 'premium'
+            limit = PREMIUM_CAPSULE_LIMIT if is_premium else FREE_CAPSULE_LIMIT
+
+            text = t(lang, "capsule_list", count=capsule_rows[0].total, limit=limit)
+
+            content_emoji = {
+                "text": "📝",
+                "photo": "📷",
+                "video": "🎥",
+                "document": "📎",
+                "voice": "🎙️"
+            }
+
+            user_timezone = userdata.get('timezone', 'UTC')
+            recipient_self_text = t(lang, "recipient_self")
+            delete_text = t(lang, "delete_capsule")
+            capsule_keyboard = []
+            # Rows are unpacked directly in the selected column order
+            for capsule_id, content_type, recipient_type, delivery_time, created_at, _ in capsule_rows:
+                emoji = content_emoji.get(content_type, "📦")
+
+                recipient = recipient_self_text if recipient_type == "self" else recipient_type
+
+                # Format time using user's local timezone
+                local_delivery_time_str = format_time_for_user(delivery_time, user_timezone, lang)
+                local_created_time_str = format_time_for_user(created_at, user_timezone, lang)
+
+                item_text = t(lang, "capsule_item",
+                            emoji=emoji,
+                            type=content_type,
+                            recipient=recipient,
+                            time=local_delivery_time_str,
+                            created=local_created_time_str)
+
+                text += f"\n{item_text}"
+
+                capsule_keyboard.append([
+                    InlineKeyboardButton(
+                        f"{emoji} {local_delivery_time_str.split()[1]}",  # Just the time part HH:MM
+                        callback_data=f"view_{capsule_id}"
+                    ),
+                    InlineKeyboardButton(
+                        delete_text,
+                        callback_data=f"delete_{capsule_id}"
+                    )
+                ])
+
+            capsule_keyboard.append([_main_menu_button(lang)])
+            keyboard = InlineKeyboardMarkup(capsule_keyboard)
+
+        await send_menu_with_image(
+            update=update,
+            context=context,
+            image_key='capsules',  # Uses assets/capsules.png
+            caption=text,
+            keyboard=keyboard,
+            parse_mode='HTML'
+        )
 
-            return VIEWING_CAPSULES
+        return VIEWING_CAPSULES
 
     except Exception as e:
         logger.error(f"Error showing capsules: {e}")
-        keyboard = [[InlineKeyboardButton(t(lang, "main_menu"), callback_data="main_menu")]]
+        keyboard = _main_menu_keyboard(lang)
 
         # Send error message based on context
         if query and query.message:
-            await safe_edit_message(query, t(lang, "error_occurred"), InlineKeyboardMarkup(keyboard))
+            await safe_edit_message(query, t(lang, "error_occurred"), keyboard)
         else:
             message = update.message or update.effective_message
             if message:
                 await message.reply_text(
                     t(lang, "error_occurred"),
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=keyboard
                 )
 
         return SELECTING_ACTION
@@ -4,7 +4,8 @@ Predefined idea categories and templates for the Ideas feature.
 All static content keys reference translations in translations.py.
 """
 
-from datetime import datetime, timedelta, time
+from datetime import date, datetime, timedelta, time
+from functools import lru_cache
 import calendar
 
 # Categories metadata: key -> icon and ordered idea keys
@@ -72,10 +73,14 @@ def dt_in_days(days: int) -> datetime:
 
 
 def next_new_year() -> datetime:
-    now = datetime.now()
-    year = now.year + (1 if (now.month, now.day) > (1, 1) or now.month > 1 else 0)
+    return _new_year_eve_after(date.today())
+
+
+@lru_cache(maxsize=1)
+def _new_year_eve_after(today: date) -> datetime:
+    """Only depends on the date, so it is computed once a day"""
     # Deliver on Dec 31 of current or next year at 23:59 local time
-    target_year = now.year if now.month < 12 or (now.month == 12 and now.day < 31) else now.year + 1
+    target_year = today.year if today.month < 12 or (today.month == 12 and today.day < 31) else today.year + 1
     return datetime(target_year, 12, 31, 23, 59)
 
 
@@ -5,6 +5,16 @@ from telegram import Update, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from .config import MENU_IMAGES, DEFAULT_IMAGE, logger
 
+# Telegram file_id of each menu image, by path, once it has been uploaded.
+# Images only change with a deploy, which restarts the process
+_photo_file_ids: dict[str, str] = {}
+
+
+def _message_fingerprint(message) -> int:
+    """Hash of what a menu message currently shows: photo, caption and keyboard"""
+    photo_id = message.photo[-1].file_unique_id if message.photo else None
+    return hash((photo_id, message.caption, message.text, message.reply_markup))
+
 
 async def send_menu_with_image(
     update: Update,
@@ -27,6 +37,21 @@ async def send_menu_with_image(
     """
     query = update.callback_query
 
+    # The menu last sent to this user as (message_id, hash of the request,
+    # fingerprint of the message as sent). Other handlers edit captions and
+    # keyboards in place, so the message the button came from must still
+    # look exactly as it did when it was sent
+    menu_key = hash((image_key, caption, keyboard, parse_mode))
+    if (query and query.message and context.user_data is not None
+            and context.user_data.get('_last_menu') == (
+                query.message.message_id, menu_key, _message_fingerprint(query.message))):
+        # Same menu is already on screen - skip the delete and resend
+        try:
+            await query.answer()
+        except Exception as e:
+            logger.debug(f"Could not answer callback query: {e}")
+        return
+
     # Get image path
     image_path = MENU_IMAGES.get(image_key, DEFAULT_IMAGE)
 
@@ -46,26 +71,38 @@ async def send_menu_with_image(
             except Exception as e:
                 logger.debug(f"Could not delete message: {e}")
 
-            # Send new message with image
-            with open(image_path, 'rb') as photo_file:
-                await update.effective_chat.send_photo(
-                    photo=photo_file,
-                    caption=caption,
-                    reply_markup=keyboard,
-                    parse_mode=parse_mode
-                )
+            send_photo = update.effective_chat.send_photo
         else:
             # Regular message command
+            send_photo = update.effective_message.reply_photo
+
+        file_id = _photo_file_ids.get(image_path)
+        if file_id:
+            # Telegram already has this image - send it by reference
+            sent = await send_photo(
+                photo=file_id,
+                caption=caption,
+                reply_markup=keyboard,
+                parse_mode=parse_mode
+            )
+        else:
+            # Send new message with image
             with open(image_path, 'rb') as photo_file:
-                await update.effective_message.reply_photo(
+                sent = await send_photo(
                     photo=photo_file,
                     caption=caption,
                     reply_markup=keyboard,
                     parse_mode=parse_mode
                 )
+            _photo_file_ids[image_path] = sent.photo[-1].file_id
+
+        if context.user_data is not None:
+            context.user_data['_last_menu'] = (sent.message_id, menu_key, _message_fingerprint(sent))
 
     except Exception as e:
         logger.error(f"Error sending image menu: {e}")
+        # The stored file_id may be the problem - upload the file next time
+        _photo_file_ids.pop(image_path, None)
         # Fallback to text-only
         try:
             if query:
@@ -0,0 +1,44 @@
+# migrations/versions/008_add_capsule_list_index.py
+"""
+Migration: Add index for the "My capsules" list query
+Version: 008
+Description: Covers the user_id + delivered filter and delivery_time ordering
+             used by show_capsules so the list is served from the index
+"""
+from sqlalchemy import text
+
+
+def upgrade(engine):
+    """Create composite index on capsules(user_id, delivered, delivery_time)"""
+    with engine.connect() as conn:
+        db_url = str(engine.url)
+
+        if 'sqlite' in db_url:
+            # SQLite
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_capsules_user_pending "
+                "ON capsules (user_id, delivered, delivery_time)"
+            ))
+            conn.commit()
+            print("✓ Added ix_capsules_user_pending index (SQLite)")
+
+        elif 'postgresql' in db_url:
+            # PostgreSQL - covering index for an index-only scan
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_capsules_user_pending "
+                "ON capsules (user_id, delivered, delivery_time) "
+                "INCLUDE (content_type, recipient_type, created_at)"
+            ))
+            conn.commit()
+            print("✓ Added ix_capsules_user_pending index (PostgreSQL)")
+
+        else:
+            print("⚠ Unsupported database type")
+
+
+def downgrade(engine):
+    """Drop the capsule list index"""
+    with engine.connect() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_capsules_user_pending"))
+        conn.commit()
+        print("✓ Removed ix_capsules_user_pending index")
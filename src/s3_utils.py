@@ -1,41 +1,88 @@
 # src/s3_utils.py
+import asyncio
+import io
+import os
+import threading
 import uuid
-from typing import Optional
+from typing import AsyncIterable, Optional, Union
 import boto3
 from botocore.client import Config
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .config import (
     YANDEX_ACCESS_KEY, YANDEX_SECRET_KEY, YANDEX_BUCKET_NAME,
-    YANDEX_REGION, master_cipher, logger
+    YANDEX_REGION, S3_MAX_CONCURRENT, S3_UPLOAD_CONCURRENCY, master_cipher, logger
 )
 
+# Caps in-flight S3 requests across all threads so bursts don't run into
+# provider rate limits (503 SlowDown)
+_s3_slots = threading.BoundedSemaphore(S3_MAX_CONCURRENT)
+
+# One client for the whole process: boto3 clients are thread-safe, so all
+# worker threads share its connection pool and skip the TLS handshake
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
 def get_s3_client():
-    """Initialize and return S3 client for Yandex Object Storage"""
-    try:
-        return boto3.client(
-            service_name='s3',
-            endpoint_url='https://storage.yandexcloud.net',
-            aws_access_key_id=YANDEX_ACCESS_KEY,
-            aws_secret_access_key=YANDEX_SECRET_KEY,
-            region_name=YANDEX_REGION,
-            config=Config(signature_version='s3v4')
-        )
-    except Exception as e:
-        logger.error(f"Failed to create S3 client: {e}")
-        return None
+    """Return the shared S3 client for Yandex Object Storage, creating it on first use"""
+    global _s3_client
+    if _s3_client is not None:
+        return _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            try:
+                _s3_client = boto3.client(
+                    service_name='s3',
+                    endpoint_url='https://storage.yandexcloud.net',
+                    aws_access_key_id=YANDEX_ACCESS_KEY,
+                    aws_secret_access_key=YANDEX_SECRET_KEY,
+                    region_name=YANDEX_REGION,
+                    config=Config(
+                        signature_version='s3v4',
+                        # Enough pooled connections for every request _s3_slots lets through
+                        max_pool_connections=S3_MAX_CONCURRENT,
+                        # Retries throttling and transient errors with backoff
+                        retries={'mode': 'standard', 'max_attempts': 5}
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Failed to create S3 client: {e}")
+        return _s3_client
+
+# Encrypted objects start with this header followed by the AES-GCM nonce.
+# Objects without it were written with Fernet and are decrypted as before.
+ENCRYPTION_HEADER = b'DTC1'
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# Multipart uploads: every part except the last must be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+DECRYPT_CHUNK_SIZE = 1024 * 1024
 
-def encrypt_and_upload_file(file_bytes: bytes, file_extension: str) -> tuple[Optional[str], Optional[bytes]]:
+# DeleteObjects accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# How long queued deletes wait for more keys before they are sent
+DELETE_FLUSH_DELAY = 1.0
+# DeleteObjects requests in flight when a flush spans several batches
+DELETE_CONCURRENCY = 12
+
+_pending_deletes: list[str] = []
+_delete_flush: Optional[asyncio.Task] = None
+
+def encrypt_and_upload_file(file_bytes: Union[bytes, bytearray, memoryview], file_extension: str) -> tuple[Optional[str], Optional[bytes]]:
     """
     Encrypt file and upload to S3
+    Accepts any bytes-like object, so downloaded buffers are not copied
     Returns (s3_key, encrypted_file_key)
     """
     try:
         # Generate unique key for this file
-        file_key = Fernet.generate_key()
-        file_cipher = Fernet(file_key)
+        file_key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(NONCE_SIZE)
 
         # Encrypt file content
-        encrypted_content = file_cipher.encrypt(file_bytes)
+        encrypted_content = ENCRYPTION_HEADER + nonce + AESGCM(file_key).encrypt(nonce, memoryview(file_bytes), None)
 
         # Generate S3 key
         s3_key = f"capsules/{uuid.uuid4()}.{file_extension}.enc"
@@ -46,45 +93,162 @@ def encrypt_and_upload_file(file_bytes: bytes, file_extension: str) -> tuple[Opt
             logger.error("S3 client not available")
             return None, None
 
-        s3_client.put_object(
+        with _s3_slots:
+            s3_client.put_object(
+                Bucket=YANDEX_BUCKET_NAME,
+                Key=s3_key,
+                Body=encrypted_content
+            )
+
+        # Encrypt the file key with master key
+        encrypted_file_key = master_cipher.encrypt(file_key)
+
+        logger.info(f"File uploaded to S3: {s3_key}")
+        return s3_key, encrypted_file_key
+
+    except Exception as e:
+        logger.error(f"Error in encrypt_and_upload_file: {e}")
+        return None, None
+
+def _upload_part(s3_client, s3_key: str, upload_id: str, part_number: int, body: bytearray) -> dict:
+    """Upload one multipart part (blocking)"""
+    with _s3_slots:
+        response = s3_client.upload_part(
+            Bucket=YANDEX_BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+    return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+async def encrypt_and_upload_stream(chunks: AsyncIterable[bytes], file_extension: str,
+                                    max_concurrency: int = S3_UPLOAD_CONCURRENCY) -> tuple[Optional[str], Optional[bytes]]:
+    """
+    Encrypt a stream of chunks and upload it to S3 as a multipart upload
+    Up to max_concurrency parts upload in parallel while the stream keeps
+    filling the next one, so memory is bounded by the part size regardless of file size.
+    The stored object has the same layout as encrypt_and_upload_file output
+    Returns (s3_key, encrypted_file_key)
+    """
+    s3_client = get_s3_client()
+    if not s3_client:
+        logger.error("S3 client not available")
+        return None, None
+
+    file_key = AESGCM.generate_key(bit_length=256)
+    nonce = os.urandom(NONCE_SIZE)
+    encryptor = Cipher(algorithms.AES(file_key), modes.GCM(nonce)).encryptor()
+    s3_key = f"capsules/{uuid.uuid4()}.{file_extension}.enc"
+
+    upload_id = None
+    part_tasks = []
+    part_slots = asyncio.Semaphore(max_concurrency)
+
+    def start_part(part_number: int, body: bytearray):
+        task = asyncio.create_task(asyncio.to_thread(
+            _upload_part, s3_client, s3_key, upload_id, part_number, body
+        ))
+        task.add_done_callback(lambda _: part_slots.release())
+        part_tasks.append(task)
+
+    try:
+        upload = await asyncio.to_thread(
+            s3_client.create_multipart_upload, Bucket=YANDEX_BUCKET_NAME, Key=s3_key
+        )
+        upload_id = upload['UploadId']
+
+        buffer = bytearray(ENCRYPTION_HEADER + nonce)
+        async for chunk in chunks:
+            buffer += encryptor.update(chunk)
+            if len(buffer) >= PART_SIZE:
+                # Waits while max_concurrency parts are still uploading
+                await part_slots.acquire()
+                for task in part_tasks:
+                    if task.done() and task.exception():
+                        raise task.exception()
+                start_part(len(part_tasks) + 1, buffer)
+                buffer = bytearray()
+
+        # GCM tag goes last, as in AESGCM.encrypt output
+        buffer += encryptor.finalize()
+        buffer += encryptor.tag
+        await part_slots.acquire()
+        start_part(len(part_tasks) + 1, buffer)
+
+        parts = await asyncio.gather(*part_tasks)
+
+        await asyncio.to_thread(
+            s3_client.complete_multipart_upload,
             Bucket=YANDEX_BUCKET_NAME,
             Key=s3_key,
-            Body=encrypted_content
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
         )
 
         # Encrypt the file key with master key
         encrypted_file_key = master_cipher.encrypt(file_key)
 
-        logger.info(f"File uploaded to S3: {s3_key}")
+        logger.info(f"File streamed to S3: {s3_key} ({len(parts)} parts)")
         return s3_key, encrypted_file_key
 
     except Exception as e:
-        logger.error(f"Error in encrypt_and_upload_file: {e}")
+        logger.error(f"Error in encrypt_and_upload_stream: {e}")
+        for task in part_tasks:
+            task.cancel()
+        if upload_id:
+            try:
+                await asyncio.to_thread(
+                    s3_client.abort_multipart_upload,
+                    Bucket=YANDEX_BUCKET_NAME, Key=s3_key, UploadId=upload_id
+                )
+            except Exception as abort_error:
+                logger.warning(f"Failed to abort multipart upload {s3_key}: {abort_error}")
         return None, None
 
-def download_and_decrypt_file(s3_key: str, encrypted_file_key: bytes) -> Optional[bytes]:
+def _decrypt_stream(body, file_key: bytes) -> io.BytesIO:
+    """Decrypt an AES-GCM object chunk by chunk as it is read from S3.
+    The header has already been consumed; the last TAG_SIZE bytes are the tag.
+    The plaintext is written straight into the returned buffer, with no final copy"""
+    nonce = body.read(NONCE_SIZE)
+    decryptor = Cipher(algorithms.AES(file_key), modes.GCM(nonce)).decryptor()
+    plaintext = io.BytesIO()
+    tail = b''
+    for chunk in body.iter_chunks(DECRYPT_CHUNK_SIZE):
+        data = tail + chunk
+        tail = data[-TAG_SIZE:]
+        plaintext.write(decryptor.update(memoryview(data)[:-TAG_SIZE]))
+    decryptor.finalize_with_tag(tail)
+    plaintext.seek(0)
+    return plaintext
+
+def download_and_decrypt_file(s3_key: str, encrypted_file_key: bytes) -> Optional[io.BytesIO]:
     """
     Download file from S3 and decrypt
-    Returns decrypted file bytes
+    Returns a buffer over the decrypted file, positioned at its start
     """
     try:
         # Decrypt the file key
         file_key = master_cipher.decrypt(encrypted_file_key)
-        file_cipher = Fernet(file_key)
 
         # Download from S3
         s3_client = get_s3_client()
         if not s3_client:
             return None
 
-        response = s3_client.get_object(
-            Bucket=YANDEX_BUCKET_NAME,
-            Key=s3_key
-        )
-        encrypted_content = response['Body'].read()
+        with _s3_slots:
+            response = s3_client.get_object(
+                Bucket=YANDEX_BUCKET_NAME,
+                Key=s3_key
+            )
+            body = response['Body']
 
-        # Decrypt file
-        decrypted_content = file_cipher.decrypt(encrypted_content)
+            # Decrypt file while it streams in, without holding the ciphertext
+            header = body.read(len(ENCRYPTION_HEADER))
+            if header == ENCRYPTION_HEADER:
+                decrypted_content = _decrypt_stream(body, file_key)
+            else:
+                decrypted_content = io.BytesIO(Fernet(file_key).decrypt(header + body.read()))
 
         logger.info(f"File downloaded and decrypted: {s3_key}")
         return decrypted_content
@@ -93,6 +257,64 @@ def download_and_decrypt_file(s3_key: str, encrypted_file_key: bytes) -> Optiona
         logger.error(f"Error in download_and_decrypt_file: {e}")
         return None
 
+def _delete_batch(s3_client, batch: list[str]):
+    """Delete up to DELETE_BATCH_SIZE files with one DeleteObjects request (blocking)"""
+    try:
+        with _s3_slots:
+            response = s3_client.delete_objects(
+                Bucket=YANDEX_BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        for error in response.get('Errors', []):
+            logger.error(f"Error deleting file from S3 {error.get('Key')}: {error.get('Message')}")
+        logger.info(f"Files deleted from S3: {len(batch)}")
+    except Exception as e:
+        logger.error(f"Error deleting {len(batch)} files from S3: {e}")
+
+def _delete_batches(s3_keys: list[str]) -> list[list[str]]:
+    """Split keys into DeleteObjects-sized batches"""
+    return [s3_keys[start:start + DELETE_BATCH_SIZE] for start in range(0, len(s3_keys), DELETE_BATCH_SIZE)]
+
+def delete_files_from_s3(s3_keys: list[str]):
+    """Delete several files from S3 with one DeleteObjects request per batch"""
+    s3_client = get_s3_client()
+    if not s3_client:
+        logger.error("S3 client not available for deletion")
+        return
+
+    for batch in _delete_batches(s3_keys):
+        _delete_batch(s3_client, batch)
+
+async def _flush_deletes():
+    """Send the queued deletes once DELETE_FLUSH_DELAY has passed.
+    Batches go out concurrently, at most DELETE_CONCURRENCY at a time"""
+    global _delete_flush
+    await asyncio.sleep(DELETE_FLUSH_DELAY)
+    s3_keys = _pending_deletes[:]
+    _pending_deletes.clear()
+    _delete_flush = None
+
+    s3_client = get_s3_client()
+    if not s3_client:
+        logger.error("S3 client not available for deletion")
+        return
+
+    batch_slots = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def delete_batch(batch: list[str]):
+        async with batch_slots:
+            await asyncio.to_thread(_delete_batch, s3_client, batch)
+
+    await asyncio.gather(*(delete_batch(batch) for batch in _delete_batches(s3_keys)))
+
+def schedule_s3_delete(s3_key: str):
+    """Queue a file for deletion without waiting for S3.
+    Keys queued close together are removed with a single DeleteObjects request"""
+    global _delete_flush
+    _pending_deletes.append(s3_key)
+    if _delete_flush is None:
+        _delete_flush = asyncio.get_running_loop().create_task(_flush_deletes())
+
 def delete_file_from_s3(s3_key: str):
     """Delete file from S3"""
     try:
@@ -101,10 +323,11 @@ def delete_file_from_s3(s3_key: str):
             logger.error("S3 client not available for deletion")
             return
 
-        s3_client.delete_object(
-            Bucket=YANDEX_BUCKET_NAME,
-            Key=s3_key
-        )
+        with _s3_slots:
+            s3_client.delete_object(
+                Bucket=YANDEX_BUCKET_NAME,
+                Key=s3_key
+            )
         logger.info(f"File deleted from S3: {s3_key}")
 
     except Exception as e:
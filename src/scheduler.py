@@ -1,23 +1,30 @@
 # src/scheduler.py
+import asyncio
 from datetime import datetime, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
-from telegram import Bot
+from telegram import Bot, InputFile
+from telegram.error import TelegramError, Forbidden, BadRequest
 from telegram.ext import Application
 from sqlalchemy import select, and_
-from .database import capsules, engine, mark_capsule_delivered, get_user_by_internal_id
+from .database import (
+    capsules, engine, claim_capsule_for_delivery, release_capsule_claim, get_user_by_internal_id,
+    get_user_data_by_telegram_id, capsule_invite_token
+)
 from .s3_utils import download_and_decrypt_file
 from .config import logger
 from .translations import t
+from .timezone_utils import format_time_for_user
 
 # Track notified capsules to avoid spam
 _notified_pending_capsules = set()
 
+# How late a delivery job may start and still run
+MISFIRE_GRACE_TIME_SECONDS = 3600
+
 async def deliver_capsule(bot: Bot, capsule_id: int):
     """Deliver a time capsule to recipient"""
     try:
-        from telegram.error import TelegramError, Forbidden, BadRequest
-
         with engine.connect() as conn:
             capsule = conn.execute(
                 select(capsules).where(capsules.c.id == capsule_id)
@@ -50,7 +57,6 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
 
             # Format the created_at time
             try:
-                from .timezone_utils import format_time_for_user
                 sender_timezone = sender_data.get('timezone', 'UTC')
                 created_at = format_time_for_user(capsule_data['created_at'], sender_timezone, sender_lang)
             except:
@@ -63,6 +69,9 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
 
             # GROUP/CHANNEL DELIVERY
             if recipient_type in ['group', 'channel']:
+                if not claim_capsule_for_delivery(capsule_id):
+                    logger.info(f"Capsule {capsule_id} already delivered by another run")
+                    return
                 try:
                     chat_id = int(capsule_data['recipient_id'])
 
@@ -88,7 +97,6 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                     )
 
                     logger.info(f"✅ Capsule {capsule_id} delivered to {recipient_type} {chat_id} in {delivery_lang}")
-                    mark_capsule_delivered(capsule_id)
                     return
 
                 except Forbidden:
@@ -98,7 +106,6 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                         text=t(sender_lang, 'group_not_member'),
                         parse_mode='HTML'
                     )
-                    mark_capsule_delivered(capsule_id)
                 except BadRequest as e:
                     logger.error(f"❌ {recipient_type.title()} {chat_id} not found or invalid: {e}")
                     await bot.send_message(
@@ -106,9 +113,10 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                         text=t(sender_lang, 'delivery_failed_invalid_chat'),
                         parse_mode='HTML'
                     )
-                    mark_capsule_delivered(capsule_id)
                 except Exception as e:
                     logger.error(f"❌ Error delivering to {recipient_type}: {e}")
+                    # Possibly transient - let the next check retry it
+                    release_capsule_claim(capsule_id)
                     await bot.send_message(
                         chat_id=sender_data['telegram_id'],
                         text=t(sender_lang, 'delivery_failed_error'),
@@ -125,13 +133,8 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                 # Check if we already notified about this capsule
                 if capsule_id not in _notified_pending_capsules:
                     # Generate invite link
-                    import base64
-                    encoded_uuid = base64.urlsafe_b64encode(
-                        capsule_data['capsule_uuid'].encode()
-                    ).decode().rstrip('=')
-
-                    bot_username = (await bot.get_me()).username
-                    invite_link = f"https://t.me/{bot_username}?start=c_{encoded_uuid}"
+                    invite_token = capsule_invite_token(capsule_data['capsule_uuid'])
+                    invite_link = f"https://t.me/{bot.username}?start=c_{invite_token}"
 
                     notification_text = t(
                         sender_lang,
@@ -154,13 +157,16 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                 return
 
             # Activated - deliver to user
+            if not claim_capsule_for_delivery(capsule_id):
+                logger.info(f"Capsule {capsule_id} already delivered by another run")
+                return
+
             try:
                 user_id = int(capsule_data['recipient_id'])
 
                 # FIXED: Get recipient's preferred language
                 recipient_lang = 'en'  # Default fallback
                 try:
-                    from .database import get_user_data_by_telegram_id
                     recipient_user_data = get_user_data_by_telegram_id(user_id)
                     if recipient_user_data:
                         recipient_lang = recipient_user_data.get('language_code', 'en')
@@ -181,10 +187,16 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                 # Send media if present
                 if capsule_data['content_type'] in ('photo', 'video', 'document', 'voice'):
                     try:
-                        file_data = download_and_decrypt_file(
+                        # S3 download and decryption block - keep them off the event loop
+                        file_data = await asyncio.to_thread(
+                            download_and_decrypt_file,
                             capsule_data['s3_key'],
                             capsule_data['file_key']
                         )
+                        if file_data is None:
+                            raise ValueError(f"Media of capsule {capsule_id} could not be downloaded")
+                        # Stream the buffer as is instead of reading it into another copy
+                        file_data = InputFile(file_data, read_file_handle=False)
 
                         if capsule_data['content_type'] == 'photo':
                             await bot.send_photo(
@@ -229,7 +241,6 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                     )
 
                 logger.info(f"✅ Capsule {capsule_id} delivered to user {user_id} in {recipient_lang}")
-                mark_capsule_delivered(capsule_id)
                 return
 
             except Forbidden:
@@ -239,7 +250,6 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                     text=t(sender_lang, 'delivery_failed_blocked'),
                     parse_mode='HTML'
                 )
-                mark_capsule_delivered(capsule_id)
 
             except BadRequest as e:
                 logger.error(f"❌ Invalid chat {user_id}: {e}")
@@ -248,10 +258,11 @@ async def deliver_capsule(bot: Bot, capsule_id: int):
                     text=t(sender_lang, 'delivery_failed_invalid_chat'),
                     parse_mode='HTML'
                 )
-                mark_capsule_delivered(capsule_id)
 
             except Exception as e:
                 logger.error(f"❌ Error delivering to user: {e}")
+                # Possibly transient - let the next check retry it
+                release_capsule_claim(capsule_id)
                 await bot.send_message(
                     chat_id=sender_data['telegram_id'],
                     text=t(sender_lang, 'delivery_failed_error'),
@@ -287,34 +298,31 @@ def init_scheduler(application: Application) -> AsyncIOScheduler:
 
     try:
         with engine.connect() as conn:
+            # Only the columns needed for scheduling - no content or file keys
             pending_capsules = conn.execute(
-                select(capsules)
+                select(capsules.c.id, capsules.c.delivery_time)
                 .where(capsules.c.delivered == False)
             ).fetchall()
 
-            for capsule in pending_capsules:
-                cap_dict = dict(capsule._mapping)
-                delivery_time = cap_dict['delivery_time'].replace(tzinfo=timezone.utc)
-
-                if delivery_time <= datetime.now(timezone.utc):
-                    scheduler.add_job(
-                        deliver_capsule,
-                        'date',
-                        run_date=datetime.now(timezone.utc),
-                        args=[application.bot, cap_dict['id']],
-                        id=f"capsule_{cap_dict['id']}",
-                        replace_existing=True
-                    )
-                else:
-                    scheduler.add_job(
-                        deliver_capsule,
-                        trigger=DateTrigger(run_date=delivery_time),
-                        args=[application.bot, cap_dict['id']],
-                        id=f"capsule_{cap_dict['id']}",
-                        replace_existing=True
-                    )
-
-            logger.info(f"Scheduled {len(pending_capsules)} pending capsules")
+        # The connection is back in the pool before any job is registered.
+        # Jobs added before scheduler.start() are queued and committed to
+        # the job store in one pass when the scheduler starts
+        now = datetime.now(timezone.utc)
+        for capsule_id, delivery_time in pending_capsules:
+            delivery_time = delivery_time.replace(tzinfo=timezone.utc)
+            scheduler.add_job(
+                deliver_capsule,
+                trigger=DateTrigger(run_date=max(delivery_time, now)),
+                args=[application.bot, capsule_id],
+                id=f"capsule_{capsule_id}",
+                replace_existing=True,
+                # A delivery that fires late (e.g. after a restart or a busy
+                # event loop) still runs once instead of being dropped
+                misfire_grace_time=MISFIRE_GRACE_TIME_SECONDS,
+                coalesce=True
+            )
+
+        logger.info(f"Scheduled {len(pending_capsules)} pending capsules")
 
     except Exception as e:
         logger.error(f"Error initializing scheduler: {e}")
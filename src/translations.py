@@ -1,4 +1,5 @@
 # src/translations.py
+from functools import lru_cache
 
 TRANSLATIONS = {
     'ru': {
@@ -737,7 +738,25 @@ If you have payment issues:
     }
 }
 
+@lru_cache(maxsize=8192)
+def _t_cached(lang: str, key: str, kwargs_items: tuple) -> str:
+    """Translated and formatted text for hashable arguments"""
+    text = TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
+    return text.format_map(dict(kwargs_items))
+
 def t(lang: str, key: str, **kwargs) -> str:
     """Get translated text"""
-    text = TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
-    return text.format(**kwargs) if kwargs else text
+    if not kwargs:
+        # Most texts take no arguments - a plain lookup, no formatting or cache key
+        return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
+    try:
+        return _t_cached(lang, key, tuple(kwargs.items()))
+    except TypeError:
+        # Unhashable argument values - format without caching
+        text = TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
+        return text.format_map(kwargs)
+
+def t_many(lang: str, keys) -> list:
+    """Get translated texts for several keys in one lookup"""
+    table = TRANSLATIONS.get(lang, TRANSLATIONS['en'])
+    return [table.get(key, key) for key in keys]
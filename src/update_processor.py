@@ -0,0 +1,54 @@
+# src/update_processor.py
+import asyncio
+from typing import Any, Awaitable
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently, while updates of the
+    same chat run one at a time in arrival order. A slow upload in one chat
+    no longer holds up button presses in others, and each conversation
+    still sees its steps in sequence
+    """
+
+    __slots__ = ('_chat_locks', '_chat_pending')
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_pending: dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            # Not bound to a chat (e.g. pre-checkout queries) - nothing to order against
+            await super().process_update(update, coroutine)
+            return
+
+        chat_id = chat.id
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_pending[chat_id] = self._chat_pending.get(chat_id, 0) + 1
+        try:
+            # The chat lock is taken before one of the max_concurrent_updates
+            # slots, so updates queued behind a busy chat don't hold slots other
+            # chats need. asyncio.Lock wakes waiters in FIFO order, so updates
+            # keep their order
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._chat_pending[chat_id] -= 1
+            if not self._chat_pending[chat_id]:
+                # Last update of this chat for now - drop its lock
+                del self._chat_pending[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        """Nothing to set up - locks are created per chat on demand"""
+
+    async def shutdown(self) -> None:
+        """Nothing to release - locks are dropped once a chat has no pending updates"""